@@ -14,6 +14,14 @@ GRID_MD5_REF=41c68dc4b5c9dccacba3fe38c9b5a3cf
 GRID_FOLDER=gpw-v4-national-identifier-grid-rev11_30_sec_asc
 GRID_URL=${BASE_URL}gpw-v4-national-identifier-grid-rev11/gpw-v4-national-identifier-grid-rev11_30_sec_asc.zip
 
+# Pass --keep-zipped to skip extracting the archives. The python package can
+# read all input files straight from the .zip archives.
+EXTRACT=1
+if [ "$1" == "--keep-zipped" ]
+then
+    EXTRACT=0
+fi
+
 # trap ctrl-c and call ctrl_c()
 trap ctrl_c INT
 
@@ -110,12 +118,12 @@ then
     get_data
 fi
 
-if [ ! -d $PROJECT_FOLDER$GRID_FOLDER ]
+if [ $EXTRACT == 1 ] && [ ! -d $PROJECT_FOLDER$GRID_FOLDER ]
 then
     unzip $PROJECT_FOLDER$GRID_FILE -d $PROJECT_FOLDER$GRID_FOLDER
 fi
 
-if [ ! -d $PROJECT_FOLDER$POPULATION_FOLDER ]
+if [ $EXTRACT == 1 ] && [ ! -d $PROJECT_FOLDER$POPULATION_FOLDER ]
 then
     unzip $PROJECT_FOLDER$POPULATION_FILE -d $PROJECT_FOLDER$POPULATION_FOLDER
 fi
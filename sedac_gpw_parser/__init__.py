@@ -10,3 +10,7 @@ from . import grid
 from . import population
 from . import plot
 from . import run
+from . import regrid
+from . import stats
+from . import raster
+from . import profiling
@@ -0,0 +1,285 @@
+"""
+Command-line interface to run the stages of the analysis pipeline separately.
+
+Usage:
+
+    sedac-gpw-parser index
+    sedac-gpw-parser extract [--countries ID [ID ...]] [--jobs N]
+                             [--scale SCALE]
+    sedac-gpw-parser export [--countries ...] [--format csv|npy|npz]
+                            [--dtype float32|float64] [--scale SCALE]
+                            [--output FOLDER]
+    sedac-gpw-parser plot [--countries ...] [--jobs N] [--fast]
+                          [--output FOLDER]
+    sedac-gpw-parser stats [--countries ...] [--jobs N] [--output FILE|-]
+
+All stages skip countries whose output already exists. Hence, an interrupted
+stage can simply be started again. To split a stage across the jobs of a job
+array on a batch scheduler use --shard INDEX/COUNT. For example, --shard 3/10
+processes every 10th country starting with the 4th one (INDEX is zero-based).
+
+Each stage requires the output of the previous stages for the same countries:
+index -> extract -> export, plot or stats.
+
+Use --profile FILE to record the time, I/O and memory used by each country and
+stage (see profiling.py).
+"""
+import os
+import sys
+import csv
+import argparse
+import contextlib
+import multiprocessing
+import numpy as np
+from sedac_gpw_parser.grid import Grid
+from sedac_gpw_parser.population import Population
+from sedac_gpw_parser.plot import render_countries, SKIPPED_COUNTRIES
+from sedac_gpw_parser.stats import STATISTICS, batch_statistics, save_table
+from sedac_gpw_parser.utils import load_registry
+from sedac_gpw_parser.profiling import profile
+
+DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
+OUTPUT_FOLDER = DATA_FOLDER + "output/"
+
+
+def _select_countries(args):
+    """
+    Get the ids of all countries to process in the current (sharded) job.
+
+    :param args: The parsed command-line arguments.
+    :type args: argparse.Namespace
+
+    :rtype: list of int
+    """
+    if args.countries:
+        country_ids = args.countries
+    else:
+        country_ids = load_registry().country_ids()
+
+    if args.shard:
+        index, count = [int(_s) for _s in args.shard.split("/")]
+        country_ids = country_ids[index::count]
+
+    return country_ids
+
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """
+    Redirect all output to stdout to stderr, also that of worker processes.
+
+    Besides sys.stdout, the file descriptor of stdout is redirected such that
+    worker processes that are started within the context print their progress
+    to stderr as well.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def _run_parallel(function, tasks, jobs):
+    """Apply a function to all tasks using a pool of worker processes."""
+    if jobs == 1:
+        return [function(task) for task in tasks]
+
+    with multiprocessing.Pool(jobs) as pool:
+        return pool.map(function, tasks, chunksize=1)
+
+
+def _extract_country(task):
+    """Parse and store the grid and the population of a single country."""
+    country_id, scale = task
+    Population(country_id, load=False, scale=scale)
+
+
+def _export_country(task):
+    """Export the stored population of a single country."""
+    country_id, output_path, file_format, dtype, scale = task
+    pop = Population(country_id)
+    pop.export(output_path, file_format=file_format, dtype=dtype, scale=scale)
+
+
+def index(args):
+    """Generate the index of input files that contain each country."""
+    Grid(country_id=None)
+
+
+def extract(args):
+    """Parse and store the data of all selected countries."""
+    # Make sure the file index exists before the workers are started
+    Grid(country_id=None)
+
+    tasks = [(_c, args.scale) for _c in _select_countries(args)
+             if not os.path.exists(
+                 OUTPUT_FOLDER + "{0}_population.txt".format(_c))]
+    _run_parallel(_extract_country, tasks, args.jobs)
+
+
+def export(args):
+    """Export the data of all selected countries as tables or binary files."""
+    if args.scale is not None and args.format == "csv":
+        raise ValueError("--scale is only supported for the npy and npz "
+                         "formats.")
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    tasks = []
+    for country_id in _select_countries(args):
+        output_path = os.path.join(
+            args.output, "{0}.{1}".format(country_id, args.format))
+        if not os.path.exists(output_path):
+            tasks.append((country_id, output_path, args.format,
+                          np.dtype(args.dtype), args.scale))
+
+    _run_parallel(_export_country, tasks, args.jobs)
+
+
+def plot(args):
+    """
+    Plot the data of all selected countries.
+
+    Countries that span the -180/180 degree longitude line are skipped (see
+    plot.SKIPPED_COUNTRIES).
+    """
+    registry = load_registry()
+    countries = []
+
+    for country_id in _select_countries(args):
+        if country_id in SKIPPED_COUNTRIES:
+            print(country_id, "caused errors in the past. Skipping for now...")
+        elif not os.path.exists(
+                os.path.join(args.output, "{0}.png".format(country_id))):
+            countries.append((country_id, registry.name(country_id)))
+    render_countries(countries, plot_folder=args.output, processes=args.jobs,
+                     fast=args.fast)
+
+
+def stats(args):
+    """Compute population-weighted statistics for all selected countries."""
+    output_path = args.output
+
+    # Each shard writes its own file
+    if args.shard and output_path != "-":
+        root, extension = os.path.splitext(output_path)
+        output_path = "{0}_{1}{2}".format(
+            root, args.shard.replace("/", "_of_"), extension)
+
+    if os.path.exists(output_path):
+        print(output_path, "already present.")
+        return
+
+    if output_path == "-":
+        # Keep stdout free for the table
+        context = _stdout_to_stderr()
+    else:
+        context = contextlib.nullcontext()
+
+    with context:
+        table = batch_statistics(_select_countries(args), processes=args.jobs,
+                                 statistics=args.statistics)
+
+    if output_path == "-":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(("country_id", "statistic", "value"))
+        writer.writerows(table)
+    else:
+        save_table(table, output_path)
+
+
+def _parser():
+    """Create the parser for all command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="sedac-gpw-parser",
+        description="Parse, export, plot and analyze the SEDAC GPW "
+                    "population data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    profiling = argparse.ArgumentParser(add_help=False)
+    profiling.add_argument("--profile", metavar="FILE",
+                           help="Write the time, I/O and memory used by each "
+                                "stage and country to a .json or .csv file")
+
+    common = argparse.ArgumentParser(add_help=False, parents=[profiling])
+    common.add_argument("--countries", type=int, nargs="+",
+                        help="The ids of the countries to process (default: "
+                             "all countries)")
+    common.add_argument("--shard", metavar="INDEX/COUNT",
+                        help="Only process every COUNT-th country starting "
+                             "with country number INDEX (zero-based)")
+    common.add_argument("--jobs", type=int, default=1,
+                        help="The number of worker processes")
+
+    subparsers.add_parser(
+        "index", parents=[profiling], help="Generate the index of input files for each country"
+        ).set_defaults(function=index)
+
+    extract_parser = subparsers.add_parser(
+        "extract", parents=[common],
+        help="Parse and store grid and population of each country")
+    extract_parser.add_argument("--scale", type=int,
+                                help="Store the population as integers in "
+                                     "units of 1/SCALE people")
+    extract_parser.set_defaults(function=extract)
+
+    export_parser = subparsers.add_parser(
+        "export", parents=[common],
+        help="Export the population of each country")
+    export_parser.add_argument("--format", choices=("csv", "npy", "npz"),
+                               default="npz")
+    export_parser.add_argument("--dtype", choices=("float32", "float64"),
+                               default="float64")
+    export_parser.add_argument("--scale", type=int,
+                               help="Store the population as uint32 in units "
+                                    "of 1/SCALE people (npy and npz only)")
+    export_parser.add_argument("--output", default="./export/",
+                               help="The output folder")
+    export_parser.set_defaults(function=export)
+
+    plot_parser = subparsers.add_parser(
+        "plot", parents=[common], help="Plot the population of each country")
+    plot_parser.add_argument("--fast", action="store_true",
+                             help="Downsample the data before plotting")
+    plot_parser.add_argument("--output", default="./plots/",
+                             help="The output folder")
+    plot_parser.set_defaults(function=plot)
+
+    stats_parser = subparsers.add_parser(
+        "stats", parents=[common],
+        help="Compute population-weighted statistics for each country")
+    stats_parser.add_argument("--statistics", nargs="+", choices=STATISTICS,
+                              default=STATISTICS)
+    stats_parser.add_argument("--output", default="./statistics.csv",
+                              help="The output file or - to print the "
+                                   "statistics")
+    stats_parser.set_defaults(function=stats)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Run a single stage of the pipeline as specified on the command line.
+
+    :param argv: The command-line arguments. If None, sys.argv is used.
+    :type argv: list of str
+    """
+    args = _parser().parse_args(argv)
+
+    if getattr(args, "profile", None):
+        with profile(args.profile):
+            args.function(args)
+    else:
+        args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,9 @@ country across the 8 different input files.
 
 Particularly, the provided class Grid contains a formalism to store the grid
 for each country in a space-efficient on the disk. For this a custom file
-format is used that contains all valid grid points of a country.
+format is used that contains all valid grid points of a country. In memory,
+the grid cells of each input file are held as ranges of columns per row (see
+TileCoords).
 
 An example of an output file could look like this:
 
@@ -35,6 +37,8 @@ was previously already processed using the Grid class.
 """
 import os
 import numpy as np
+from sedac_gpw_parser.utils import open_input, open_output
+from sedac_gpw_parser.profiling import profiled
 
 GRID_FILENAME = "gpw_v4_national_identifier_grid_rev11_30_sec_{0}.asc"
 COUNTRY_COORDS_FILENAME = "{0}_valid_indices.txt"
@@ -42,84 +46,215 @@ FILE_INDEX_NAME = "file_index.txt"
 DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
 
 
-def _compress(array):
+def _runs(mask):
     """
-    Compress a one-dimensional list with sequential entries.
+    Find the ranges of consecutive True entries in a boolean array.
 
-    If a range of consecutive numbers occurs within a list only the first and
-    last entry of that range or stored. Using the function _decompress() this
-    special format can be converted into the original list again.
+    :param mask: The boolean array.
+    :type mask: 1d numpy array
 
-    See the examples below for what the script does.
+    :returns: The lower (inclusive) and upper (exclusive) bounds of each range.
+    :rtype: tuple of 1d numpy arrays
 
-    :param array: The list that one wishes to compress.
-    :type array: 1d numpy array or list
+    Examples:
+    >>> _runs(np.array([True, True, False, True, False, True]))
+    (array([0, 3, 5]), array([2, 4, 6]))
+    """
+    changes = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(changes == 1)
+    ends = np.flatnonzero(changes == -1)
 
-    :return: A representation of the compressed list or array.
-    :rtype: str
+    return starts, ends
 
-    Examples:
-    >>> _compress([0,1,3,4,5,8])
-    '0,2 3,6 8,9'
 
-    >>> _compress([0,3,4,5,8,9,13,14,15])
-    '0,1 3,6 8,10 13,16'
+class TileCoords():
     """
-    mask = np.diff(array) != 1
-    upper_bounds = np.array(array[:-1])[mask]
-    lower_bounds = np.array(array[1:])[mask]
-    lower_bounds = np.append(np.min(array), lower_bounds)
-    upper_bounds = np.append(upper_bounds, np.max(array)) + 1
+    Compact representation of all grid cells of a country within one input
+    file (tile).
+
+    The cells are stored as ranges (runs) of consecutive columns in each row
+    using a CSR-like layout:
 
-    lower_bounds = lower_bounds.astype(int)
-    upper_bounds = upper_bounds.astype(int)
+    - rows: The sorted ids of all rows that contain the country (int32).
+    - indptr: The runs of rows[i] are found at positions indptr[i] to
+      indptr[i+1] (exclusive) in starts and ends (int64).
+    - starts, ends: The lower (inclusive) and upper (exclusive) column of each
+      run (int32).
 
-    assert len(lower_bounds) == len(upper_bounds)
+    For example the rows
 
-    outstring = ""
-    for lower_bound, upper_bound in zip(lower_bounds, upper_bounds):
-        outstring += str(lower_bound) + "," + str(upper_bound) + " "
+    2206 77,101
+    2207 72,106 108,112
 
-    outstring = outstring[:-1]
+    are stored as rows=[2206, 2207], indptr=[0, 1, 3], starts=[77, 72, 108]
+    and ends=[101, 106, 112].
+    """
 
-    return outstring
 
+    def __init__(self, rows, indptr, starts, ends):
+        """
+        Initialize an instance of TileCoords.
 
-def _decompress(ranges):
-    """
-    Decompresses a list with sequential entries that is stored as a string
-    created from _compress().
+        :param rows: The sorted ids of all rows that contain the country.
+        :type rows: 1d array of int
 
-    See the help of _compress() for more information. Also see below for
-    examples on the format of the input.
+        :param indptr: The positions of the runs of each row in starts and
+                       ends.
+        :type indptr: 1d array of int
 
-    :param ranges: Specially formatted strings containing the ranges in the
-                   desired list.
-    :type range: list of str
+        :param starts: The lower (inclusive) column of each run.
+        :type starts: 1d array of int
 
-    Examples:
-    >>> _decompress(['0,2', '3,6', '8,9'])
-    [0, 1, 3, 4, 5, 8]
+        :param ends: The upper (exclusive) column of each run.
+        :type ends: 1d array of int
+        """
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+
+        assert len(self.indptr) == len(self.rows) + 1
+        assert len(self.starts) == len(self.ends) == self.indptr[-1]
+
+
+    @classmethod
+    def from_runs(cls, row_runs):
+        """
+        Create an instance from the runs of each row.
+
+        :param row_runs: The row id and the lower and upper bounds of all runs
+                         in that row. Rows must be sorted.
+        :type row_runs: list of (int, list of int, list of int)
+
+        :rtype: TileCoords
+
+        Examples:
+        >>> tile = TileCoords.from_runs([(2206, [77], [101]),
+        ...                              (2207, [72, 108], [106, 112])])
+        >>> tile.indptr
+        array([0, 1, 3])
+        """
+        rows = [row_id for row_id, _, _ in row_runs]
+        lengths = [len(starts) for _, starts, _ in row_runs]
+        indptr = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        starts = [_s for _, row_starts, _ in row_runs for _s in row_starts]
+        ends = [_e for _, _, row_ends in row_runs for _e in row_ends]
+
+        return cls(rows, indptr, starts, ends)
+
+
+    def __len__(self):
+        """Return the number of rows that contain the country."""
+        return len(self.rows)
+
+
+    def n_cells(self):
+        """Return the total number of grid cells."""
+        return int(np.sum(self.ends - self.starts, dtype=np.int64))
+
+
+    def iter_runs(self):
+        """
+        Iterate over all rows and their runs.
+
+        :rtype: generator of (int, 1d numpy array, 1d numpy array)
+        """
+        for i, row_id in enumerate(self.rows):
+            lower, upper = self.indptr[i], self.indptr[i+1]
+            yield int(row_id), self.starts[lower:upper], self.ends[lower:upper]
+
+
+    def columns(self, row_id):
+        """
+        Get all columns of a row that contain the country.
 
-    >>> _decompress(['0,1', '3,6', '8,10', '13,16'])
-    [0, 3, 4, 5, 8, 9, 13, 14, 15]
+        :param row_id: The id of the row.
+        :type row_id: int
+
+        :returns: The sorted column ids. Empty if the row does not contain the
+                  country.
+        :rtype: 1d numpy array
+
+        Examples:
+        >>> tile = TileCoords.from_runs([(3, [0, 4], [2, 6])])
+        >>> tile.columns(3)
+        array([0, 1, 4, 5])
+        """
+        i = np.searchsorted(self.rows, row_id)
+        if i == len(self.rows) or self.rows[i] != row_id:
+            return np.zeros(0, dtype=np.int64)
+
+        lower, upper = self.indptr[i], self.indptr[i+1]
+
+        return _expand_runs(self.starts[lower:upper], self.ends[lower:upper])
+
+
+    def cell_indices(self):
+        """
+        Get the row and column ids of all grid cells.
+
+        The result can directly be used for fancy-indexing, e.g.,
+        array[tile.cell_indices()].
+
+        :rtype: tuple of 1d numpy arrays
+
+        Examples:
+        >>> tile = TileCoords.from_runs([(2, [0], [2]), (5, [1, 4], [2, 6])])
+        >>> tile.cell_indices()
+        (array([2, 2, 5, 5, 5]), array([0, 1, 1, 4, 5]))
+        """
+        run_lengths = (self.ends - self.starts).astype(np.int64)
+        cumulative = np.concatenate(([0], np.cumsum(run_lengths)))
+        row_lengths = cumulative[self.indptr[1:]] - \
+            cumulative[self.indptr[:-1]]
+
+        row_ids = np.repeat(self.rows.astype(np.int64), row_lengths)
+        col_ids = _expand_runs(self.starts, self.ends)
+
+        return row_ids, col_ids
+
+
+    def bounding_box(self):
+        """
+        Get the smallest and largest row and column id of all grid cells.
+
+        :returns: (min_row, max_row, min_col, max_col), all inclusive, or None
+                  if the tile contains no cells.
+        :rtype: tuple of int
+
+        Examples:
+        >>> tile = TileCoords.from_runs([(2, [3], [5]), (5, [1, 4], [2, 6])])
+        >>> tile.bounding_box()
+        (2, 5, 1, 5)
+        """
+        if len(self.starts) == 0:
+            return None
+
+        return (int(self.rows[0]), int(self.rows[-1]), int(self.starts.min()),
+                int(self.ends.max()) - 1)
+
+
+def _expand_runs(starts, ends):
     """
-    resolved_range = []
+    Expand ranges of consecutive numbers into all numbers.
 
-    for one_range in ranges:
-        lower_bound, upper_bound = one_range.split(",")
-        for _ in range(int(lower_bound), int(upper_bound)):
-            resolved_range.append(_)
+    Examples:
+    >>> _expand_runs(np.array([0, 4]), np.array([2, 7]))
+    array([0, 1, 4, 5, 6])
+    """
+    lengths = (ends - starts).astype(np.int64)
+    offsets = np.arange(lengths.sum()) - \
+        np.repeat(np.cumsum(lengths) - lengths, lengths)
 
-    return resolved_range
+    return np.repeat(starts.astype(np.int64), lengths) + offsets
 
 
-def _skip_header(infile):
+def _read_ascii_header(infile):
     """
-    Skip the first 6 lines in a file.
+    Read the 6 header lines of a sedac-gpw input file.
 
-    Useful to skip the header in the sedac-gpw input files as they usually
-    contain the following entries (or similar):
+    The header of the sedac-gpw input files usually contains the following
+    entries (or similar):
 
     ncols         10800
     nrows         10800
@@ -129,11 +264,17 @@ def _skip_header(infile):
     NODATA_value  -9999
 
     :param infile: The file-object that was opened using f = open(...)
-    :type infle: io.TextIOWrapper
+    :type infile: io.TextIOWrapper
+
+    :returns: The header entries and their (unconverted) values.
+    :rtype: dict of str
     """
-    # Itereate over the header and print the content
+    header = {}
     for _ in range(6):
-        print(infile.readline()[:-1])
+        key, value = infile.readline().split()
+        header[key] = value
+
+    return header
 
 
 class Grid():
@@ -141,6 +282,7 @@ class Grid():
     Methods for reading the gpw population data grid and storing a condensed
     version of a per-country grid to disk for later use.
     """
+    @profiled("grid")
     def __init__(
             self, country_id, output_folder=DATA_FOLDER+"output/",
             input_folder=DATA_FOLDER+"gpw-v4-national-identifier-grid-rev11_30_sec_asc/",
@@ -149,14 +291,17 @@ class Grid():
 
         :param country_id: The numerical ID of a country in the population
                            dataset. A list of valid IDs is found in the
-                           grid-data's lookup table.
+                           grid-data's lookup table. If None, only the file
+                           index is generated (if necessary) and loaded.
         :type country_id: int
 
         :param output_folder: The relative path to the desired output folder.
         :type output_folder: str
 
         :param input_folder: The relative path to the input data containing the
-                             eight grid files.
+                             eight grid files. If the folder does not exist,
+                             the files are read from the .zip archive of the
+                             same name.
         :type input_folder: str
 
         :param overwrite: If True, existing data will be written over.
@@ -181,6 +326,9 @@ class Grid():
             self.save_file_index()
         self.load_file_index()
 
+        if country_id is None:
+            return
+
         # Get the coordinates in each file that represent the given country
         if not os.path.exists(self._country_coords_path):
             self.parse_country_coords()
@@ -198,33 +346,38 @@ class Grid():
         grid_path = self._grid_path
 
         coords = {}
+        country_str = str(country_id)
 
         for file_id in file_ids:
 
-            with open(grid_path.format(file_id)) as infile:
+            with open_input(grid_path.format(file_id)) as infile:
 
-                file_coords = {}
+                row_runs = []
 
-                # Skip the header
-                _skip_header(infile)
+                header = _read_ascii_header(infile)
+                n_row = int(header["nrows"])
+                n_col = int(header["ncols"])
 
                 # Iterate over each line containing data
-                for row_id in range(10800):
+                for row_id in range(n_row):
 
                     print(row_id, end="\r")
                     line = infile.readline()
-                    if " {0} ".format(country_id) in line:
+                    # The leading space also finds the country in the first
+                    # column
+                    if " {0} ".format(country_id) in " " + line:
                         line = line.split(" ")
                         assert line[0] != ""
                         assert line[-1] == "\n"
-                        assert len(line) == 10801
-                        col_ids = [_x for _x in range(10800) if line[_x] == str(country_id)]
-                        file_coords[row_id] = col_ids
+                        assert len(line) == n_col + 1
+                        mask = np.array(line[:-1]) == country_str
+                        starts, ends = _runs(mask)
+                        row_runs.append((row_id, starts, ends))
 
                 # Check that all lines have really been read
                 assert infile.readline() == ""
 
-                coords[file_id] = file_coords
+                coords[file_id] = TileCoords.from_runs(row_runs)
 
         self._country_coords = coords
 
@@ -263,11 +416,12 @@ class Grid():
 
         header = "#file_id, line_number, column_numbers\n"
 
-        with open(outfile_name, "w") as outfile:
+        with open_output(outfile_name) as outfile:
             outfile.write(header)
             for file_id, file_coords in coords.items():
-                for line_id, col_ids in file_coords.items():
-                    col_ranges = _compress(col_ids)
+                for line_id, starts, ends in file_coords.iter_runs():
+                    col_ranges = " ".join("{0},{1}".format(_s, _e)
+                                          for _s, _e in zip(starts, ends))
                     line = "{0} {1} {2}\n".format(file_id, line_id, col_ranges)
                     outfile.write(line)
 
@@ -284,7 +438,7 @@ class Grid():
         file_ids = self._file_ids
         file_name = self._country_coords_path
 
-        coords = {file_id: {} for file_id in file_ids}
+        row_runs = {file_id: [] for file_id in file_ids}
 
         with open(file_name, "r") as infile:
             infile.readline()
@@ -293,11 +447,16 @@ class Grid():
                 line = line[:-1].split(" ")
                 file_id = int(line[0])
                 row_id = int(line[1])
-                col_ids = _decompress(line[2:])
+                bounds = [_r.split(",") for _r in line[2:]]
+                starts = [int(_b[0]) for _b in bounds]
+                ends = [int(_b[1]) for _b in bounds]
 
-                coords[file_id][row_id] = col_ids
+                row_runs[file_id].append((row_id, starts, ends))
 
-        self._country_coords = coords
+        # Rows are stored in ascending order for each file
+        self._country_coords = {
+            file_id: TileCoords.from_runs(sorted(runs, key=lambda _r: _r[0]))
+            for file_id, runs in row_runs.items()}
 
 
     def generate_file_index(self):
@@ -318,12 +477,12 @@ class Grid():
         for i in range(1, 9):
             current_ids = set()
 
-            with open(grid_path.format(i)) as infile:
+            with open_input(grid_path.format(i)) as infile:
 
-                _skip_header(infile)
+                header = _read_ascii_header(infile)
 
                 # Iterate over each line containing data
-                for j in range(10800):
+                for j in range(int(header["nrows"])):
                     line = infile.readline()[:-1]
                     while line[-1] == " ":
                         line = line[:-1]
@@ -335,7 +494,9 @@ class Grid():
 
             current_ids.discard("-32768")
 
-            for j in current_ids:
+            # Sort the ids such that the index is always written in the same
+            # order
+            for j in sorted(current_ids, key=int):
                 if int(j) in file_index.keys():
                     file_index[int(j)].append(i)
                 else:
@@ -368,7 +529,7 @@ class Grid():
         file_index = self._file_index
         file_index_path = self._file_index_path
 
-        with open(file_index_path, "w") as outfile:
+        with open_output(file_index_path) as outfile:
             outfile.write("#COUNTRY_ID FILE_IDS\n")
             for country_id, file_ids in file_index.items():
                 file_ids = [str(_f) for _f in file_ids]
@@ -397,4 +558,6 @@ class Grid():
                 file_index[int(country)] = file_list
 
         self._file_index = file_index
-        self._file_ids = file_index[country_id]
+
+        if country_id is not None:
+            self._file_ids = file_index[country_id]
@@ -0,0 +1,290 @@
+"""
+Expose the stored population data as lazy, chunked dask arrays.
+
+Instead of loading the entire population array of a country into memory, the
+data is split into chunks of rows. Each chunk decodes only its own rows from
+the file in the custom file format (see population.py) when it is computed.
+For this, the position of each row in the file is determined once when the
+task graph is built and each task starts reading at the position of its first
+row. Hence, large computations can be scheduled out of core and across the
+workers of a dask cluster.
+
+The global mosaic combines the stored data of many countries into one lazy
+array that covers the entire globe. The rows of each country that overlap with
+a row of chunks are decoded only once by a single task that is shared by all
+chunks in this row.
+
+dask (and xarray for as_xarray()) are optional dependencies that can be
+installed with `pip install dask[array] xarray`.
+"""
+import os
+import functools
+import numpy as np
+from sedac_gpw_parser.population import _decompress_array, _read_header
+
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask = None
+
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+
+
+def _require(module, name):
+    """Raise an ImportError if an optional dependency is missing."""
+    if module is None:
+        raise ImportError(
+            "{0} is required for this function. Install it with "
+            "'pip install {0}'.".format(name))
+
+
+def _row_offsets(input_file):
+    """
+    Find the position of each row of data in a file in the custom file format.
+
+    The positions are cached until the file is modified.
+
+    :param input_file: The path to the file.
+    :type input_file: str
+
+    :returns: The byte offset of each row and of the end of the file.
+    :rtype: 1d numpy array
+    """
+    return _cached_row_offsets(input_file, os.path.getmtime(input_file))
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_row_offsets(input_file, modification_time):
+    """Find the position of each row of data, see _row_offsets()."""
+    offsets = []
+    offset = 0
+
+    with open(input_file, "rb") as infile:
+        line = infile.readline()
+        # Skip the header, i.e., all lines that start with a letter
+        while line[:1].isalpha():
+            offset = infile.tell()
+            line = infile.readline()
+
+        while line:
+            offsets.append(offset)
+            offset = infile.tell()
+            line = infile.readline()
+        offsets.append(offset)
+
+    return np.array(offsets, dtype=np.int64)
+
+
+def _read_rows(input_file, offset, n_row, n_col, scale=None,
+               dtype=np.float64):
+    """
+    Decode consecutive rows from a file in the custom file format.
+
+    :param input_file: The path to the file.
+    :type input_file: str
+
+    :param offset: The byte offset of the first row, see _row_offsets().
+    :type offset: int
+
+    :param n_row: The number of rows.
+    :type n_row: int
+
+    :param n_col: The number of columns.
+    :type n_col: int
+
+    :param scale: The scale of quantized data or None.
+    :type scale: int
+
+    :param dtype: The data type of the returned array.
+    :type dtype: numpy dtype
+
+    :rtype: 2d numpy array
+    """
+    rows = np.zeros((n_row, n_col), dtype=dtype)
+
+    with open(input_file, "rb") as infile:
+        infile.seek(offset)
+        for i in range(n_row):
+            line = infile.readline().decode()
+            rows[i] = _decompress_array(line, dtype=dtype, scale=scale)
+
+    return rows
+
+
+def _header(pop):
+    """Read the header of the stored data of a Population instance."""
+    with open(pop._population_output_path, "r") as infile:
+        header = _read_header(infile)
+    pop._apply_header(header)
+
+    return header
+
+
+def as_dask_array(pop, chunk_rows=1024, dtype=np.float64):
+    """
+    Expose the stored data of a country as a lazy dask array.
+
+    :param pop: The country. The data need not be loaded, e.g.,
+                Population(country_id, load=False).
+    :type pop: population.Population
+
+    :param chunk_rows: The number of rows per chunk.
+    :type chunk_rows: int
+
+    :param dtype: The data type of the array.
+    :type dtype: numpy dtype
+
+    :returns: The population array with the values -1 (no data) and -2 (not
+              in country). Rows are ordered from north to south.
+    :rtype: dask.array.Array
+    """
+    _require(dask, "dask[array]")
+    _header(pop)
+
+    input_file = pop._population_output_path
+    n_row, n_col = pop._nlat, pop._nlon
+    offsets = _row_offsets(input_file)
+
+    chunks = []
+    for start in range(0, n_row, chunk_rows):
+        stop = min(start + chunk_rows, n_row)
+        chunk = dask.delayed(_read_rows)(input_file, int(offsets[start]),
+                                         stop - start, n_col,
+                                         scale=pop._scale, dtype=dtype)
+        chunks.append(da.from_delayed(chunk, shape=(stop - start, n_col),
+                                      dtype=dtype))
+
+    return da.concatenate(chunks, axis=0)
+
+
+def as_xarray(pop, chunk_rows=1024, dtype=np.float64):
+    """
+    Expose the stored data of a country as a lazy xarray.DataArray.
+
+    Same as as_dask_array() but with the coordinates 'latitude' (see
+    Population.latitude_range()) and 'longitude' (see
+    Population.longitude_range()) attached.
+
+    :rtype: xarray.DataArray
+    """
+    _require(xr, "xarray")
+    data = as_dask_array(pop, chunk_rows=chunk_rows, dtype=dtype)
+
+    return xr.DataArray(
+        data, dims=("latitude", "longitude"), name="population",
+        coords={"latitude": np.flip(pop.latitude_range()),
+                "longitude": pop.longitude_range()})
+
+
+def _place_blocks(blocks, row_start, row_stop, col_start, col_stop, dtype):
+    """
+    Combine the rows of all countries that overlap with a chunk of the globe.
+
+    :param blocks: The decoded rows of each overlapping country, the position
+                   of the first row in the global grid and the position of
+                   the first column of the country in the global grid.
+    :type blocks: list of (2d numpy array, int, int)
+
+    :returns: The chunk with -2 outside of all countries.
+    :rtype: 2d numpy array
+    """
+    chunk = np.full((row_stop - row_start, col_stop - col_start), -2,
+                    dtype=dtype)
+
+    for rows, first_row, col_origin in blocks:
+        last_row = first_row + rows.shape[0]
+        first_col = max(col_start, col_origin)
+        last_col = min(col_stop, col_origin + rows.shape[1])
+
+        part = rows[:, (first_col - col_origin):(last_col - col_origin)]
+        view = chunk[(first_row - row_start):(last_row - row_start),
+                     (first_col - col_start):(last_col - col_start)]
+        in_country = part > -2
+        view[in_country] = part[in_country]
+
+    return chunk
+
+
+def global_mosaic(populations, chunks=(2160, 4320), dtype=np.float64):
+    """
+    Combine the stored data of many countries into one lazy global array.
+
+    The array has 21600 rows (from 90 to -90 degrees latitude) and 43200
+    columns (from -180 to 180 degrees longitude). For each row of chunks, the
+    overlapping rows of each country are decoded once and shared by all chunks
+    in this row. Chunks that do not overlap with any country are filled with
+    -2 without reading any data.
+
+    :param populations: The countries. The data need not be loaded, e.g.,
+                        Population(country_id, load=False).
+    :type populations: list of population.Population
+
+    :param chunks: The number of rows and columns per chunk.
+    :type chunks: tuple of int
+
+    :param dtype: The data type of the array.
+    :type dtype: numpy dtype
+
+    :rtype: dask.array.Array
+    """
+    _require(dask, "dask[array]")
+
+    windows = []
+    cellsize = None
+    for pop in populations:
+        _header(pop)
+        cellsize = pop._cellsize
+        row_origin, col_origin = pop.global_origin()
+        input_file = pop._population_output_path
+        windows.append((input_file, row_origin, col_origin, pop._nlat,
+                        pop._nlon, pop._scale, _row_offsets(input_file)))
+
+    n_row = int(round(180 / cellsize)) if cellsize else 21600
+    n_col = 2 * n_row
+    chunk_rows, chunk_cols = chunks
+
+    blocks = []
+    for row_start in range(0, n_row, chunk_rows):
+        row_stop = min(row_start + chunk_rows, n_row)
+
+        # Decode the rows of each country in this row of chunks only once
+        row_blocks = []
+        for (input_file, row_origin, col_origin, country_rows, country_cols,
+             scale, offsets) in windows:
+            first_row = max(row_start, row_origin)
+            last_row = min(row_stop, row_origin + country_rows)
+            if first_row >= last_row:
+                continue
+
+            rows = dask.delayed(_read_rows)(
+                input_file, int(offsets[first_row - row_origin]),
+                last_row - first_row, country_cols, scale=scale, dtype=dtype)
+            row_blocks.append((rows, first_row, col_origin, country_cols))
+
+        block_row = []
+        for col_start in range(0, n_col, chunk_cols):
+            col_stop = min(col_start + chunk_cols, n_col)
+
+            overlapping = [
+                (_rows, _first_row, _col_origin)
+                for _rows, _first_row, _col_origin, _n_col in row_blocks
+                if _col_origin < col_stop and _col_origin + _n_col > col_start]
+
+            shape = (row_stop - row_start, col_stop - col_start)
+            if overlapping:
+                chunk = dask.delayed(_place_blocks)(
+                    overlapping, row_start, row_stop, col_start, col_stop,
+                    dtype)
+                block_row.append(da.from_delayed(chunk, shape=shape,
+                                                 dtype=dtype))
+            else:
+                block_row.append(da.full(shape, -2, dtype=dtype,
+                                         chunks=shape))
+
+        blocks.append(block_row)
+
+    return da.block(blocks)
@@ -5,22 +5,174 @@ Relies on parsing input data that has been preprocessed by the classes Grid and
 Population.
 """
 import os
+import functools
+import multiprocessing
 from matplotlib import pyplot as plt
 from matplotlib import cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import numpy as np
 from .population import Population
+from .profiling import profiled, stage
 
+# Number of positive pixels used to estimate the upper limit of the colorscale
+# in fast mode
+VMAX_SAMPLE_SIZE = 1000000
+
+# The countries that span the -180/180 degree longitude line and hence cause
+# an array of population data that is too large to be plotted on a map:
+# - New Zealand (554)
+# - Russia (643)
+# - USA (840)
+SKIPPED_COUNTRIES = (554, 643, 840)
+
+
+@functools.lru_cache(maxsize=None)
+def _map_features(resolution="50m"):
+    """
+    Load the geometries of country borders and coastlines once.
+
+    The geometries are read from the natural earth shapefiles on the first call
+    and reused for all following plots. Calling this function before spawning
+    worker processes (e.g., using multiprocessing with the fork start method)
+    makes the cached geometries available to all workers.
+
+    :param resolution: The resolution of the natural earth data set. One of
+                       '10m', '50m' or '110m'.
+    :type resolution: str
+
+    :returns: The features for the country borders and the coastlines.
+    :rtype: tuple of cartopy.feature.ShapelyFeature
+    """
+    border = cfeature.NaturalEarthFeature(
+        'cultural', 'admin_0_countries', resolution)
+    coastline = cfeature.NaturalEarthFeature(
+        'physical', 'coastline', resolution)
+
+    border = cfeature.ShapelyFeature(
+        tuple(border.geometries()), ccrs.PlateCarree(), edgecolor='black',
+        facecolor="None")
+    coastline = cfeature.ShapelyFeature(
+        tuple(coastline.geometries()), ccrs.PlateCarree(), edgecolor='black',
+        facecolor="None")
+
+    return border, coastline
+
+
+def _downsample(data, max_rows, max_cols):
+    """
+    Reduce the resolution of a population array by averaging blocks of pixels.
+
+    Each block of pixels is replaced by the mean of all pixels with valid
+    population data (>= 0) in that block. Blocks without valid data but with
+    at least one pixel inside the country are set to -1 (no data), all other
+    blocks to -2 (not in country). The array is processed in strips of blocks
+    to be light on memory.
+
+    :param data: The population array
+    :type data: 2d numpy array
+
+    :param max_rows: The maximum number of rows of the output.
+    :type max_rows: int
+
+    :param max_cols: The maximum number of columns of the output.
+    :type max_cols: int
+
+    :returns: The downsampled population array.
+    :rtype: 2d numpy array
+
+    Examples:
+    >>> _downsample(np.array([[1., 3., -2.], [-1., -2., -2.]]), 1, 2)
+    array([[ 2., -2.]])
+    """
+    n_row, n_col = data.shape
+    row_factor = max(1, int(np.ceil(n_row / max_rows)))
+    col_factor = max(1, int(np.ceil(n_col / max_cols)))
+
+    if row_factor == 1 and col_factor == 1:
+        return data
+
+    out_rows = int(np.ceil(n_row / row_factor))
+    out_cols = int(np.ceil(n_col / col_factor))
+    pad_cols = out_cols * col_factor - n_col
+
+    downsampled = np.full((out_rows, out_cols), -2.0)
+
+    for i in range(out_rows):
+        strip = data[i*row_factor:(i+1)*row_factor]
+        strip = np.pad(strip, ((0, 0), (0, pad_cols)), constant_values=-2)
+        strip = strip.reshape(len(strip), out_cols, col_factor)
+
+        valid = strip >= 0
+        counts = valid.sum(axis=(0, 2))
+        sums = np.where(valid, strip, 0).sum(axis=(0, 2))
+        in_country = (strip > -2).any(axis=(0, 2))
+
+        downsampled[i][in_country] = -1
+        has_data = counts > 0
+        downsampled[i][has_data] = sums[has_data] / counts[has_data]
+
+    return downsampled
 
-def _add_colorbar_axs(fig, plot_axs):
 
+def _estimate_vmax(data, percentile=90, sample_size=VMAX_SAMPLE_SIZE):
+    """
+    Estimate a percentile of all positive entries in a population array.
+
+    Instead of selecting all positive pixels only every n-th pixel of the array
+    is considered such that roughly *sample_size* pixels enter the estimate.
+
+    :param data: The population array
+    :type data: 2d numpy array
+
+    :param percentile: The percentile to estimate.
+    :type percentile: float
+
+    :param sample_size: The approximate number of pixels to sample.
+    :type sample_size: int
+
+    :returns: The estimated percentile or 0 if no positive pixel was found.
+    :rtype: float
+    """
+    flat = data.reshape(-1)
+    step = max(1, flat.size // sample_size)
+    positive = flat[::step]
+    positive = positive[positive > 0]
+
+    # Sparse countries in large bounding boxes: fall back to all pixels
+    if step > 1 and len(positive) < 0.01 * sample_size:
+        positive = flat[flat > 0]
+
+    if len(positive) > 0:
+        return np.percentile(positive, percentile)
+
+    return 0
+
+
+def _colorbar_position(plot_axs):
+    """
+    Get the position of the colorbar next to the map axes.
+
+    The position of the map axes depends on its extent and on the size of the
+    figure, so it must be computed after both are final.
+
+    :returns: The left, bottom, width and height in figure coordinates.
+    :rtype: list of float
+    """
     axpos = plot_axs.get_position()
     pos_x = axpos.x0 + axpos.width + 0.025
     pos_y = axpos.y0 + axpos.height * 0.1
     cax_width = 0.025
     cax_height = axpos.height * 0.8
-    cax = fig.add_axes([pos_x, pos_y, cax_width, cax_height])
+
+    return [pos_x, pos_y, cax_width, cax_height]
+
+
+def _add_colorbar_axs(fig, plot_axs):
+
+    cax = fig.add_axes(_colorbar_position(plot_axs))
 
     return cax
 
@@ -112,7 +264,8 @@ class Plot(Population):
         self._cmap = cmap
 
 
-    def plot(self, title="", show=False):
+    @profiled("plot")
+    def plot(self, title="", show=False, fast=False, vmax=None):
         """
         Plot the population data for the specified country on a map.
 
@@ -122,6 +275,16 @@ class Plot(Population):
         :param show: Whether or not to show the plot inline. Set to True if you
                      use this class within a Jupyter Notebook.
         :type show: bool
+
+        :param fast: If True, the data is downsampled to the pixel resolution of
+                     the figure before drawing and the upper limit of the
+                     colorscale is estimated from a sample of all pixels. Use
+                     this to quickly render plots for large countries.
+        :type fast: bool
+
+        :param vmax: The upper limit of the colorscale. If None, the 90th
+                     percentile of all positive pixels is used.
+        :type vmax: float
         """
         data = self._population
 
@@ -133,17 +296,22 @@ class Plot(Population):
         plt.subplots_adjust(right=0.85, left=0.05, bottom=0.05, top=0.95)
 
         # Draw map
-        border = cfeature.NaturalEarthFeature(
-            'cultural', 'admin_0_countries', '50m', edgecolor='black',
-            facecolor="None")
+        border, coastline = _map_features()
         axs.add_feature(border, zorder=2, linewidth=0.5)
-        axs.coastlines(resolution="50m", linewidth=1.5, zorder=3)
+        axs.add_feature(coastline, zorder=3, linewidth=1.5)
         self._add_padding(axs=axs)
 
-        if len(data[data > 0]) > 0:
-            vmax = np.percentile(data[data > 0], 90)
-        else:
-            vmax = 0
+        if vmax is None:
+            if fast:
+                vmax = _estimate_vmax(data)
+            elif len(data[data > 0]) > 0:
+                vmax = np.percentile(data[data > 0], 90)
+            else:
+                vmax = 0
+
+        if fast:
+            width, height = fig.get_size_inches() * fig.dpi
+            data = _downsample(data, max_rows=int(height), max_cols=int(width))
 
         colorscheme = axs.imshow(data, vmin=0, vmax=vmax, origin='upper',
                                  extent=self._img_extent, cmap=self._cmap,
@@ -162,6 +330,150 @@ class Plot(Population):
         plt.close()
 
 
+class BatchPlot():
+    """
+    Render plots for many countries while reusing a single figure.
+
+    The figure, the map axes, the map features, the image and the colorbar are
+    only created once. For each country only the image data, the extent, the
+    colorscale and the title are updated before the figure is written to disk.
+    The figure is drawn on a headless Agg canvas, i.e., no display is needed.
+    """
+
+
+    def __init__(self, fast=True):
+        """
+        Initialize an instance of BatchPlot.
+
+        :param fast: Whether to downsample the data and estimate the colorscale
+                     from a sample of all pixels. See Plot.plot() for details.
+        :type fast: bool
+        """
+        fig = Figure(figsize=(8, 8))
+        FigureCanvasAgg(fig)
+
+        axs = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+        fig.subplots_adjust(right=0.85, left=0.05, bottom=0.05, top=0.95)
+
+        border, coastline = _map_features()
+        axs.add_feature(border, zorder=2, linewidth=0.5)
+        axs.add_feature(coastline, zorder=3, linewidth=1.5)
+
+        image = axs.imshow(np.zeros((1, 1)), vmin=0, vmax=1, origin='upper',
+                           extent=(-1, 1, -1, 1), transform=ccrs.PlateCarree())
+
+        cax = _add_colorbar_axs(fig=fig, plot_axs=axs)
+        cbar = fig.colorbar(image, cax=cax, extend="max", shrink=0.85)
+        cbar.set_label("Population per pixel", size=12)
+
+        self._fig = fig
+        self._axs = axs
+        self._image = image
+        self._cbar = cbar
+        self._fast = fast
+
+
+    def plot(self, plot, title=""):
+        """
+        Render the data of one country and save the figure.
+
+        :param plot: The data of the country that is to be plotted.
+        :type plot: Plot
+
+        :param title: A title for the plot
+        :type title: str
+        """
+        fig = self._fig
+        axs = self._axs
+        image = self._image
+        data = plot.population_array()
+
+        ll_x, ur_x, ll_y, ur_y = plot._img_extent
+        fig.set_size_inches(8*(ur_x - ll_x)/(ur_y - ll_y), 8)
+
+        if self._fast:
+            vmax = _estimate_vmax(data)
+            width, height = fig.get_size_inches() * fig.dpi
+            data = _downsample(data, max_rows=int(height), max_cols=int(width))
+        elif len(data[data > 0]) > 0:
+            vmax = np.percentile(data[data > 0], 90)
+        else:
+            vmax = 0
+
+        image.set_data(data)
+        image.set_extent(plot._img_extent)
+        image.set_cmap(plot._cmap)
+        image.set_clim(0, vmax)
+        self._cbar.update_normal(image)
+
+        plot._add_padding(axs=axs)
+        self._cbar.ax.set_position(_colorbar_position(axs))
+        axs.set_title(title)
+
+        fig.savefig(plot._output_path)
+
+
+# The renderer used by each worker process of render_countries()
+_WORKER_RENDERER = None
+
+
+def _init_worker(fast):
+    """Create one BatchPlot instance per worker process."""
+    global _WORKER_RENDERER
+    _WORKER_RENDERER = BatchPlot(fast=fast)
+
+
+def _render_country(task):
+    """Load and render the data of a single country in a worker process."""
+    country_id, title, plot_folder = task
+    plot = Plot(country_id, plot_folder=plot_folder)
+    with stage("plot", country_id):
+        _WORKER_RENDERER.plot(plot, title=title)
+
+    return plot._output_path
+
+
+def render_countries(countries, plot_folder="./plots/", processes=1,
+                     fast=True):
+    """
+    Render the plots for many countries using a pool of worker processes.
+
+    Each worker reuses one figure for all countries that it renders (see
+    BatchPlot). The map features are loaded before the workers are started
+    such that they are shared with all workers.
+
+    :param countries: The numeric ids and titles of the countries to plot.
+    :type countries: list of (int, str)
+
+    :param plot_folder: The relative path to the folder in which the plots
+                        are to be saved.
+    :type plot_folder: str
+
+    :param processes: The number of worker processes.
+    :type processes: int
+
+    :param fast: Whether to use the fast plotting mode (see Plot.plot()).
+    :type fast: bool
+
+    :returns: The paths of all created plots.
+    :rtype: list of str
+    """
+    if not os.path.exists(plot_folder):
+        os.mkdir(plot_folder)
+
+    _map_features()
+
+    tasks = [(c_id, title, plot_folder) for c_id, title in countries]
+
+    if processes == 1:
+        _init_worker(fast)
+        return [_render_country(task) for task in tasks]
+
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(fast, )) as pool:
+        return pool.map(_render_country, tasks, chunksize=1)
+
+
 def main():
     """
     Plot as an example the data for Germany (country id 276).
@@ -19,12 +19,14 @@ llcrnrlat 8.56666666666699
 cellsize 0.0083333333333333
 NOTINCOUNTRY_value -2
 NODATA_value -1
+row_origin 9773
+col_origin 33857
 381x-2.0 1x125.026 498x-2.0
 377x-2.0 1x114.891 1x122.275 1x130.712 1x130.297 1x135.221 1x133.586 497x-2.0
 ...
 322x-2.0 1x20.37 1x39.449 1x40.073 1x5.32 554x-2.0
 
-The first 7 lines are the header. They describe:
+The first 9 lines are the header. They describe:
 - The longitudinal extent of the data, i.e., the number of grid-cells or pixel
   in longitudinal direction.
 - The latitudinal extent of the data, i.e., the number of grid-cells or pixel
@@ -40,6 +42,11 @@ The first 7 lines are the header. They describe:
   country (usually -2).
 - The value indicating if a pixel or grid-cell has no data but is located
   inside the considered country (usually -1).
+- The row and column of the upper left pixel in the global grid of the input
+  data (43200 columns from -180 to 180 degrees longitude and 21600 rows from
+  90 to -90 degrees latitude). Use these integer offsets to align the data of
+  different countries (see merge()). Files written by earlier versions lack
+  these two lines; the offsets are then computed from llcrnrlon and llcrnrlat.
 
 The following *nrows* lines hold the data in a compressed format. The line
 
@@ -49,43 +56,195 @@ Implies that the corresponding row of a decompressed array holds 381 times a
 -2, 1 time a 125.026 and then again 498 times a -2. The number of multipliers
 must equal the number of columns (ncols in the header). In this example we have
 381+1+498=880=ncols.
+
+Quantized storage
+-----------------
+
+Optionally, the population can be stored as integers in units of 1/scale
+people (see Population.save_compressed_population()). The header then holds an
+additional line, e.g., `scale 1000`, and the row above reads
+
+381x-2 1x125026 498x-2
+
+The values -1 and -2 keep their meaning. Integers are shorter than their float
+representation, which results in smaller files and faster decoding.
+
+Values are rounded to *accuracy* decimals when the data is parsed (see
+Population.parse_population()). Hence, each pixel deviates by at most
+0.5 * 10**-accuracy people from the input data and the total population of a
+country with N valid pixels by at most N * 0.5 * 10**-accuracy people (see
+max_total_error()). Since rounding errors are uncorrelated the actual error of
+the total is typically of the order of sqrt(N) * 0.3 * 10**-accuracy:
+
+accuracy  error per pixel  max. error of total (N = 10**6)  typical error
+1         0.05             50000                            30
+2         0.005            5000                             3
+3         0.0005           500                              0.3
+4         0.00005          50                               0.03
+
+Quantizing with scale = 10**accuracy adds no further error. A smaller scale
+adds an error of at most 0.5 / scale per pixel.
 """
 import os
+import functools
 import numpy as np
-from sedac_gpw_parser.grid import Grid
+from sedac_gpw_parser.grid import Grid, _read_ascii_header
+from sedac_gpw_parser.utils import open_input, open_output
+from sedac_gpw_parser.regrid import regrid
+from sedac_gpw_parser.profiling import profiled
 
 POPULATION_FILE_NAME = "gpw_v4_population_count_rev11_2020_30_sec_{0}.asc"
 POP_OUTPUT_FILE_NAME = "{0}_population.txt"
 DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
 
-def _decompress(indices):
+# Values that mark missing data and pixels outside of the country in quantized
+# binary exports
+UINT32_NODATA = 2**32 - 1
+UINT32_NOTINCOUNTRY = 2**32 - 2
+
+EARTH_RADIUS = 6371.0072 # Authalic radius in km
+
+def max_total_error(n_cells, accuracy=3):
+    """
+    Compute the maximum error of the total population due to rounding.
+
+    :param n_cells: The number of valid pixels.
+    :type n_cells: int
+
+    :param accuracy: The number of decimals that values are rounded to.
+    :type accuracy: int
+
+    :returns: The maximum absolute error of the total population.
+    :rtype: float
+
+    Examples:
+    >>> max_total_error(10**6, accuracy=3)
+    500.0
+
+    >>> rng = np.random.default_rng(0)
+    >>> raw = rng.random(10**5) * 1000
+    >>> stored = _dequantize(_quantize(np.round(raw, 3), 1000), 1000)
+    >>> bool(abs(stored.sum() - raw.sum()) <= max_total_error(10**5, 3))
+    True
+    """
+    return n_cells * 0.5 * 10.0**-accuracy
+
+
+def _quantize(values, scale):
     """
-    Convert a str representing a sequence of entries into a list.
+    Convert population values into integers in units of 1/scale people.
+
+    Negative values (no data or not in country) are kept as they are.
+
+    Examples:
+    >>> _quantize(np.array([125.026, -2., -1., 0.0004, 0.]), 1000)
+    array([125026,     -2,     -1,      0,      0])
+    """
+    return np.where(values >= 0, np.round(values * scale),
+                    values).astype(np.int64)
+
+
+def _dequantize(values, scale, dtype=np.float64):
+    """
+    Convert quantized integers back into population values.
+
+    Examples:
+    >>> _dequantize(np.array([125026, -2, -1, 0]), 1000)
+    array([125.026,  -2.   ,  -1.   ,   0.   ])
+    """
+    return np.where(values >= 0, values / scale, values).astype(dtype)
+
+
+def _to_uint32(values, scale):
+    """
+    Quantize population values into unsigned 32-bit integers.
+
+    Pixels without data and outside of the country are set to UINT32_NODATA
+    and UINT32_NOTINCOUNTRY.
+
+    Examples:
+    >>> _to_uint32(np.array([1.5, -1., -2.]), 1000)
+    array([      1500, 4294967295, 4294967294], dtype=uint32)
+    """
+    quantized = _quantize(values, scale)
+    assert quantized.max(initial=0) < UINT32_NOTINCOUNTRY, "Scale too large."
+
+    converted = quantized.astype(np.uint32)
+    converted[quantized == -1] = UINT32_NODATA
+    converted[quantized < -1] = UINT32_NOTINCOUNTRY
+
+    return converted
+
+
+def _decompress_array(indices, dtype=np.float64, scale=None):
+    """
+    Convert a str representing a sequence of entries into a numpy array.
 
     :param indices: One line in the custom input data that represents a
-                    sequence of entries in a list. See module docstring for 
+                    sequence of entries in a list. See module docstring for
                     information on the file format.
     :type indices: str
 
-    :returns: The decompressed list
-    :rtype: list of float
+    :param dtype: The data type of the returned array.
+    :type dtype: numpy dtype
+
+    :param scale: If not None, the entries are quantized integers in units
+                  of 1/scale (see module docstring).
+    :type scale: int
+
+    :returns: The decompressed array
+    :rtype: 1d numpy array
 
     Examples:
-    >>> _decompress("2x3.0 1x4.2 3x2.0")
-    [3.0, 3.0, 4.2, 2.0, 2.0, 2.0]
-
-    >>> _decompress("3x0 2x5 3x4")
-    [0.0, 0.0, 0.0, 5.0, 5.0, 4.0, 4.0, 4.0]
-    """ 
-    decompressed = []
-    for entry in indices.split(" "):
-        if "x" in entry:
-            counter, value = entry.split("x")
-        else:
-            counter = 1
-            value = entry
-        decompressed.extend(int(counter) * [float(value)])
-    return decompressed
+    >>> _decompress_array("2x3.0 1x4.2 3x2.0")
+    array([3. , 3. , 4.2, 2. , 2. , 2. ])
+
+    >>> _decompress_array("3x0 2x5 4", dtype=np.float32)
+    array([0., 0., 0., 5., 5., 4.], dtype=float32)
+
+    >>> _decompress_array("2x-2 1x4200 1x-1", scale=1000)
+    array([-2. , -2. ,  4.2, -1. ])
+    """
+    counts = []
+    values = []
+    parse = float if scale is None else int
+    for entry in indices.split():
+        counter, _, value = entry.rpartition("x")
+        counts.append(int(counter) if counter else 1)
+        values.append(parse(value))
+
+    if scale is None:
+        return np.repeat(np.array(values, dtype=dtype), counts)
+
+    values = _dequantize(np.array(values, dtype=np.int64), scale, dtype=dtype)
+    return np.repeat(values, counts)
+
+
+def _read_header(infile):
+    """
+    Read the header of a file in the custom file format.
+
+    All lines at the beginning of the file that start with a letter are
+    considered part of the header. The file object is positioned at the first
+    line holding data afterwards.
+
+    :param infile: The file-object that was opened using f = open(...)
+    :type infile: io.TextIOWrapper
+
+    :returns: The header entries and their (unconverted) values.
+    :rtype: dict of str
+    """
+    header = {}
+    while True:
+        position = infile.tell()
+        line = infile.readline()
+        if not line[:1].isalpha():
+            infile.seek(position)
+            break
+        key, value = line.split()
+        header[key] = value
+
+    return header
 
 
 def _compress(array):
@@ -95,9 +254,9 @@ def _compress(array):
     If the list contains integer and float values the compressed array may be
     expressed in terms of integers or floats depending on the type of the first
     occurence of a number (see the last two examples below for details). Since
-    this function is only meant to be used in conjuction with the _decompress()
-    function this behaviour does not make any difference as _decompress()
-    always returns a list of floats.
+    this function is only meant to be used in conjuction with the
+    _decompress_array() function this behaviour does not make any difference
+    as _decompress_array() always returns floats.
 
     :param array: The uncompressed list
     :type array: 1d numpy array or list of int or float
@@ -135,13 +294,103 @@ def _compress(array):
     return indices
 
 
+@functools.lru_cache(maxsize=32)
+def _cell_areas(north, cellsize, n_row):
+    """
+    Compute the area of a single grid cell for each row of a window.
+
+    Since all cells in a row have the same area, a single value per row
+    suffices. The result is cached and marked read-only.
+
+    :param north: The latitude of the upper edge of the first row.
+    :type north: float
+
+    :param cellsize: The size of each grid cell in degrees.
+    :type cellsize: float
+
+    :param n_row: The number of rows.
+    :type n_row: int
+
+    :returns: The area of each cell in km^2 for each row from north to south.
+    :rtype: 1d numpy array
+
+    Examples:
+    >>> np.round(_cell_areas(60.0, 1.0, 2), 1)
+    array([6275.3, 6460.3])
+    """
+    edges = np.radians(north - np.arange(n_row + 1) * cellsize)
+    areas = EARTH_RADIUS**2 * np.radians(cellsize) * \
+        (np.sin(edges[:-1]) - np.sin(edges[1:]))
+    areas.flags.writeable = False
+
+    return areas
+
+
+def _density(population, areas):
+    """
+    Divide population counts by the cell area of each row.
+
+    Negative values (no data or not in country) are kept as they are.
+
+    Examples:
+    >>> _density(np.array([[2., -2.], [-1., 8.]]), np.array([2., 4.]))
+    array([[ 1., -2.],
+           [-1.,  2.]])
+    """
+    return np.where(population >= 0, population / areas[:, None], population)
+
+
+def merge(populations):
+    """
+    Combine the data of several countries into one array.
+
+    The array covers the smallest window that contains all countries. The data
+    is placed using the integer position of each country in the global grid
+    such that no floating point offsets are involved. Pixels outside of all
+    countries are set to -2.
+
+    :param populations: The countries to combine. The data of each country
+                        must be loaded.
+    :type populations: list of Population
+
+    :returns: The combined array and the row and column of its upper left
+              pixel in the global grid (see Population.global_origin()).
+    :rtype: tuple of (2d numpy array, int, int)
+    """
+    cellsizes = set(_p._cellsize for _p in populations)
+    assert len(cellsizes) == 1, "All countries must have the same cellsize."
+
+    windows = []
+    for pop in populations:
+        row_origin, col_origin = pop.global_origin()
+        n_row, n_col = pop.population_array().shape
+        windows.append((row_origin, col_origin, n_row, n_col))
+
+    min_row = min(_w[0] for _w in windows)
+    min_col = min(_w[1] for _w in windows)
+    max_row = max(_w[0] + _w[2] for _w in windows)
+    max_col = max(_w[1] + _w[3] for _w in windows)
+
+    merged = np.full((max_row - min_row, max_col - min_col), -2.0)
+
+    for pop, (row_origin, col_origin, n_row, n_col) in zip(populations,
+                                                           windows):
+        data = pop.population_array()
+        view = merged[(row_origin-min_row):(row_origin-min_row+n_row),
+                      (col_origin-min_col):(col_origin-min_col+n_col)]
+        in_country = data > -2
+        view[in_country] = data[in_country]
+
+    return merged, min_row, min_col
+
+
 class Population(Grid):
     
 
     def __init__(self, country_id, output_folder=DATA_FOLDER+"output/",
                  population_input_folder=DATA_FOLDER+"gpw-v4-population-count-rev11_2020_30_sec_asc/",
                  grid_input_folder=DATA_FOLDER+"gpw-v4-national-identifier-grid-rev11_30_sec_asc/",
-                 overwrite=False):
+                 overwrite=False, load=True, scale=None):
 
         assert not overwrite, "Not implemented yet!"
 
@@ -160,11 +409,14 @@ class Population(Grid):
             print("Parsing population...")
             self.parse_population()
             print("Saving population...")
-            self.save_compressed_population()
-        print("Loading population...")
-        self.load_compressed_population()
+            self.save_compressed_population(scale=scale)
+
+        # Use iter_population() to process the data block by block instead
+        if load:
+            print("Loading population...")
+            self.load_compressed_population()
 
-        print("Total population:", self.total_population())
+            print("Total population:", self.total_population())
 
 
     def population_array(self):
@@ -173,43 +425,220 @@ class Population(Grid):
 
 
     def total_population(self):
+        """
+        Get the total population of the country.
+
+        The total is computed while the data is loaded or iterated over (see
+        iter_population()). If no iteration has been completed yet, e.g., for
+        Population(country_id, load=False), the stored data is read once to
+        compute the total.
+
+        :rtype: float
+        """
+        if getattr(self, "_total_population", None) is None:
+            for _ in self.iter_population():
+                pass
 
         return self._total_population
 
 
-    def load_compressed_population(self):
+    @profiled("load_compressed_population")
+    def load_compressed_population(self, dtype=np.float64):
 
-        input_file = self._population_output_path
+        population = None
+
+        for row_offset, block in self.iter_population(dtype=dtype):
+            if population is None:
+                population = np.zeros((self._nlat, self._nlon), dtype=dtype)
+            population[row_offset:(row_offset+len(block))] = block
+            print(row_offset, end="\r")
+
+        self._population = population
+        print("Done..")
+
+
+    def iter_population(self, block_rows=1024, dtype=np.float64):
+        """
+        Iterate over the stored population data in blocks of rows.
 
-        total_population = 0
+        Each block is decoded straight from the file in the custom file format
+        (see module docstring) such that only one block is held in memory at a
+        time. The total population is accumulated while iterating and is
+        stored for total_population() once all blocks have been read. An
+        iteration that is stopped early discards the partial total.
 
-        population = []
+        Example for streaming the mean population of all valid cells:
+
+            pop = Population(country_id=250, load=False)
+            n_valid = 0
+            for row_offset, block in pop.iter_population(block_rows=256):
+                n_valid += (block >= 0).sum()
+            print(pop.total_population() / n_valid)
+
+        :param block_rows: The number of rows in each block. The last block may
+                           have less rows.
+        :type block_rows: int
+
+        :param dtype: The data type of the blocks, e.g., np.float32 to half
+                      the memory footprint.
+        :type dtype: numpy dtype
+
+        :returns: Tuples of the index of the first row of the block and the
+                  block itself.
+        :rtype: generator of (int, 2d numpy array)
+        """
+        input_file = self._population_output_path
 
         with open(input_file, "r") as infile:
 
-            n_col = int(infile.readline()[:-1].split(" ")[-1])
-            n_row = int(infile.readline()[:-1].split(" ")[-1])
-            self._llcrnrlon = float(infile.readline()[:-1].split(" ")[-1])
-            self._llcrnrlat = float(infile.readline()[:-1].split(" ")[-1])
-            self._cellsize = float(infile.readline()[:-1].split(" ")[-1])
+            self._apply_header(_read_header(infile))
+            n_row = self._nlat
+            n_col = self._nlon
+            self._total_population = None
+            total_population = 0
 
-            for _ in range(2):
-                infile.readline()
+            for row_offset in range(0, n_row, block_rows):
+                block = np.zeros((min(block_rows, n_row - row_offset), n_col),
+                                 dtype=dtype)
 
-            population = np.zeros((n_row, n_col))
+                for i in range(len(block)):
+                    block[i] = _decompress_array(infile.readline(), dtype=dtype,
+                                                 scale=self._scale)
 
-            for _ in range(n_row):
-                indices = infile.readline()
-                decompressed = np.array(_decompress(indices))
-                population[_] = decompressed
-                total_population += decompressed[decompressed > 0].sum()
-                print(_, end="\r")
+                total_population += block[block > 0].sum(dtype=np.float64)
+
+                yield row_offset, block
+
+            self._total_population = total_population
 
-        self._nlat = n_row
-        self._nlon = n_col
-        self._population = population
-        self._total_population = total_population
-        print("Done..")
+
+    def _apply_header(self, header):
+        """
+        Set the extent and resolution of the data from the header of a file in
+        the custom file format.
+
+        :param header: The header as returned by _read_header().
+        :type header: dict of str
+        """
+        self._llcrnrlon = float(header["llcrnrlon"])
+        self._llcrnrlat = float(header["llcrnrlat"])
+        self._cellsize = float(header["cellsize"])
+        self._nlat = int(header["nrows"])
+        self._nlon = int(header["ncols"])
+
+        self._scale = int(header["scale"]) if "scale" in header else None
+
+        if "row_origin" in header:
+            self._row_origin = int(header["row_origin"])
+            self._col_origin = int(header["col_origin"])
+        else:
+            # llcrnrlat is the upper edge of the lowest row
+            self._row_origin = int(round(
+                (90 - self._llcrnrlat) / self._cellsize)) - (self._nlat - 1)
+            self._col_origin = int(round(
+                (self._llcrnrlon + 180) / self._cellsize))
+
+
+    def global_origin(self):
+        """
+        Get the position of the upper left pixel in the global grid.
+
+        :returns: The row (counted from 90 degrees latitude southwards) and the
+                  column (counted from -180 degrees longitude eastwards).
+        :rtype: tuple of int
+        """
+        return self._row_origin, self._col_origin
+
+
+    def load_header(self):
+        """
+        Load only the extent and resolution of the stored data from disk.
+
+        Useful if the data itself is processed block by block using
+        iter_population().
+        """
+        with open(self._population_output_path, "r") as infile:
+            self._apply_header(_read_header(infile))
+
+
+    def regrid(self, target_grid, block_rows=1024):
+        """
+        Conservatively regrid the population counts to another grid.
+
+        See the documentation of the module regrid for details. The weights
+        are cached such that regridding further data on the same window and
+        target grid only costs one sparse matrix product. If the data was not
+        loaded into memory (see __init__) it is streamed from disk in blocks
+        of rows.
+
+        :param target_grid: The grid to which the data is regridded.
+        :type target_grid: regrid.TargetGrid
+
+        :param block_rows: The number of rows per block if the data is
+                           streamed from disk.
+        :type block_rows: int
+
+        :returns: The population count in each cell of the target grid. Rows
+                  are ordered from north to south.
+        :rtype: 2d numpy array
+        """
+        if getattr(self, "_population", None) is not None:
+            blocks = [(0, self._population)]
+        else:
+            self.load_header()
+            blocks = self.iter_population(block_rows=block_rows)
+
+        # latitude_range() holds the upper edge of each row
+        north = self.latitude_range()[-1]
+        west = self.longitude_range()[0]
+
+        return regrid(blocks, north=north, west=west, cellsize=self._cellsize,
+                      n_row=self._nlat, n_col=self._nlon,
+                      target_grid=target_grid)
+
+
+    def cell_areas(self):
+        """
+        Get the area of the grid cells in each row of the data.
+
+        :returns: The area of each cell in km^2 for each row from north to
+                  south.
+        :rtype: 1d numpy array
+        """
+        # latitude_range() holds the upper edge of each row
+        return _cell_areas(self.latitude_range()[-1], self._cellsize,
+                           self._nlat)
+
+
+    def density_array(self):
+        """
+        Get the population density, i.e., the population per km^2, of each
+        grid cell.
+
+        The values -1 (no data) and -2 (not in country) are kept.
+
+        :rtype: 2d numpy array
+        """
+        return _density(self._population, self.cell_areas())
+
+
+    def iter_density(self, block_rows=1024, dtype=np.float64):
+        """
+        Iterate over the population density in blocks of rows.
+
+        Same as iter_population() but yields the population per km^2 instead
+        of the population count.
+
+        :rtype: generator of (int, 2d numpy array)
+        """
+        areas = None
+
+        for row_offset, block in self.iter_population(block_rows=block_rows,
+                                                      dtype=dtype):
+            if areas is None:
+                areas = self.cell_areas()
+            block_areas = areas[row_offset:(row_offset+len(block))]
+            yield row_offset, _density(block, block_areas).astype(dtype)
 
 
     def latitude_range(self):
@@ -226,8 +655,18 @@ class Population(Grid):
         return lons
 
 
-    def save_compressed_population(self):
+    @profiled("save_compressed_population")
+    def save_compressed_population(self, scale=None):
+        """
+        Dump the population data to disk using the custom file format (see
+        module docstring).
 
+        :param scale: If not None, the values are stored as integers in units
+                      of 1/scale people, e.g., scale=1000 for data that was
+                      parsed with accuracy=3. See the module docstring for
+                      the resulting errors.
+        :type scale: int
+        """
         output_filepath = self._population_output_path
         population = self._population
 
@@ -241,13 +680,19 @@ class Population(Grid):
         outstring += "llcrnrlat {0}\n".format(self._llcrnrlat)
         outstring += "cellsize {0}\n".format(self._cellsize)
         outstring += "NOTINCOUNTRY_value -2\nNODATA_value -1\n"
+        outstring += "row_origin {0}\n".format(self._row_origin)
+        outstring += "col_origin {0}\n".format(self._col_origin)
+        if scale is not None:
+            outstring += "scale {0}\n".format(scale)
 
         print(outstring)
         for _, entry in enumerate(population):
             print(_, max_value, end="\r")
+            if scale is not None:
+                entry = _quantize(entry, scale)
             outstring += _compress(entry)+"\n"
 
-        with open(output_filepath, "w") as outfile:
+        with open_output(output_filepath) as outfile:
             outfile.write(outstring)
 
 
@@ -259,70 +704,80 @@ class Population(Grid):
             self._population[i][nan_pop] = np.nan
 
 
+    @profiled("parse_population")
     def parse_population(self, accuracy=3):
 
         print("Parsing population...")
         coords = self._country_coords
         input_path = self._input_path
 
-        population = np.zeros((10800*2, 10800*4))
-
-        valid_x = set()
-        valid_y = set()
+        # Get the position of each input file in the global grid and the
+        # extent of the country from the ranges of columns in each row
+        offsets = {}
+        boxes = []
 
         for file_id, file_coords in coords.items():
 
-            x_offset = 10800 * ((file_id-1) % 4)
-            y_offset = 10800 * (file_id > 4)
+            with open_input(input_path.format(file_id)) as infile:
+                header = _read_ascii_header(infile)
+
+            n_col = int(header["ncols"])
+            n_row = int(header["nrows"])
+            cellsize = float(header["cellsize"])
+
+            x_offset = n_col * ((file_id-1) % 4)
+            y_offset = n_row * (file_id > 4)
+            offsets[file_id] = (x_offset, y_offset, n_col)
 
-            with open(input_path.format(file_id)) as infile:
+            box = file_coords.bounding_box()
+            if box is not None:
+                boxes.append((box[0] + y_offset, box[1] + y_offset,
+                              box[2] + x_offset, box[3] + x_offset))
+
+        min_y = min(_b[0] for _b in boxes)
+        max_y = max(_b[1] for _b in boxes)
+        min_x = min(_b[2] for _b in boxes)
+        max_x = max(_b[3] for _b in boxes)
+
+        population = np.zeros((max_y - min_y + 1, max_x - min_x + 1))
+
+        for file_id, file_coords in coords.items():
 
-                for _ in range(4):
-                    infile.readline()
+            if len(file_coords) == 0:
+                continue
 
-                cellsize = infile.readline()
-                cellsize = float(cellsize[:-1].split(" ")[-1])
+            x_offset, y_offset, n_col = offsets[file_id]
 
-                infile.readline()
+            with open_input(input_path.format(file_id)) as infile:
 
-                all_y = list(file_coords.keys())
-                min_index = np.min(all_y)
-                max_index = np.max(all_y)
+                _read_ascii_header(infile)
 
-                for _ in range(min_index):
-                    infile.readline()
+                next_row = 0
 
-                for i in range(max_index - min_index + 1):
-                    print(file_id, i, len(population), end="\r")
-                    row_id = min_index + i
-                    if row_id not in all_y:
-                        continue
+                for row_id, starts, ends in file_coords.iter_runs():
+                    print(file_id, row_id, len(population), end="\r")
 
-                    col_id = file_coords[row_id]
+                    for _ in range(row_id - next_row):
+                        infile.readline()
+                    next_row = row_id + 1
 
                     line = infile.readline()
                     line = line.split(" ")
                     assert line[0] != ""
                     assert line[-1] == "\n"
-                    assert len(line) == 10801
+                    assert len(line) == n_col + 1
 
-                    coords_x = [_x + x_offset for _x in col_id]
-                    coords_y = [row_id + y_offset] * len(col_id)
+                    window_row = population[row_id + y_offset - min_y]
+                    shift = x_offset - min_x
 
-                    valid_x.update(coords_x)
-                    valid_y.update((row_id + y_offset,))
-
-                    pop = [float(line[_x]) + 2 for _x in col_id]
-                    population[(coords_y, coords_x)] = pop
+                    # Shift by 2 and back below to keep the exact floating
+                    # point results of earlier versions
+                    for start, end in zip(starts, ends):
+                        window_row[(start+shift):(end+shift)] = \
+                            np.array(line[start:end], dtype=float) + 2
 
                 print()
 
-        min_x = np.min(list(valid_x))
-        max_x = np.max(list(valid_x))
-        min_y = np.min(list(valid_y))
-        max_y = np.max(list(valid_y))
-
-        population = population[min_y:(max_y+1), min_x:(max_x+1)]
         population -= 2
         population[population < -1000] = -1
 
@@ -338,20 +793,93 @@ class Population(Grid):
         self._llcrnrlon = (min_x * cellsize) % 360 - 180
         self._llcrnrlat = (180 - max_y * cellsize) % 180 - 90
         self._cellsize = cellsize
+        self._row_origin = min_y
+        self._col_origin = min_x
 
 
-    def as_list(self, return_invalid=False):
+    def as_list(self, return_invalid=False, density=False):
     
-        n_lat, n_lon = self._population.shape
+        if density:
+            values = self.density_array()
+        else:
+            values = self._population
+
+        n_lat, n_lon = values.shape
         lats = np.repeat(np.flip(self.latitude_range()), n_lon)
         lons = np.tile(self.longitude_range(), n_lat)
-        table = np.stack((lons, lats, self._population.flatten())).T
+        table = np.stack((lons, lats, values.flatten())).T
       
         if not return_invalid:
             table = table[table[:, 2] > -2]
 
         return table
-        
+
+
+    def export(self, output_path, file_format="npz", dtype=np.float64,
+               scale=None):
+        """
+        Export the population data to a table or a binary file.
+
+        :param output_path: The path to the output file.
+        :type output_path: str
+
+        :param file_format: One of
+                            - 'csv': A table as returned by as_list() with the
+                              columns longitude, latitude and population.
+                            - 'npy': The population array in numpy's binary
+                              format.
+                            - 'npz': A compressed numpy archive holding the
+                              population array ('population') and the ranges
+                              of latitudes ('latitudes') and longitudes
+                              ('longitudes').
+        :type file_format: str
+
+        :param dtype: The data type of the population values.
+        :type dtype: numpy dtype
+
+        :param scale: If not None, the binary formats store the population as
+                      unsigned 32-bit integers in units of 1/scale people
+                      instead of dtype. Pixels without data and outside of
+                      the country are then set to UINT32_NODATA and
+                      UINT32_NOTINCOUNTRY. The npz archive additionally holds
+                      the scale ('scale'). Not supported for 'csv'.
+        :type scale: int
+        """
+        if file_format not in ("csv", "npy", "npz"):
+            raise ValueError("Unknown file format: " + str(file_format))
+
+        if file_format == "csv" and scale is not None:
+            raise ValueError("A scale is only supported for the npy and npz "
+                             "formats.")
+
+        # Like numpy, append the extension to the paths of binary files
+        extension = "." + file_format
+        if file_format != "csv" and not output_path.endswith(extension):
+            output_path += extension
+
+        mode = "w" if file_format == "csv" else "wb"
+
+        with open_output(output_path, mode) as outfile:
+            if file_format == "csv":
+                np.savetxt(outfile, self.as_list(), delimiter=",",
+                           header="longitude,latitude,population", comments="")
+                return
+
+            if scale is None:
+                population = self._population.astype(dtype)
+            else:
+                population = _to_uint32(self._population, scale)
+
+            if file_format == "npy":
+                np.save(outfile, population)
+            else:
+                arrays = {"population": population,
+                          "latitudes": self.latitude_range(),
+                          "longitudes": self.longitude_range()}
+                if scale is not None:
+                    arrays["scale"] = scale
+                np.savez_compressed(outfile, **arrays)
+
 
 def main():
     pop = Population(country_id=68)
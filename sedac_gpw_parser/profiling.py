@@ -0,0 +1,337 @@
+"""
+Opt-in profiling of the stages of the analysis pipeline.
+
+The following stages are measured for each country:
+
+- grid: Initialization of Grid, i.e., generating or loading the file index and
+  parsing, storing or loading the grid of the country.
+- parse_population: Population.parse_population()
+- save_compressed_population: Population.save_compressed_population()
+- load_compressed_population: Population.load_compressed_population()
+- plot: Plot.plot() and BatchPlot.plot()
+
+For each stage the wall time, the CPU time, the number of bytes read and
+written and the peak resident memory of the process are recorded. Bytes are
+counted at the level of system calls (rchar and wchar in /proc/self/io), i.e.,
+reads that are served from the page cache are included. The peak memory is the
+maximum over the lifetime of the process up to the end of the stage, and
+peak_rss_increase is the amount by which the stage raised it.
+
+Profiling is disabled by default and costs nothing then. It is enabled within
+the context profile(), which also covers worker processes that are started
+within the context. Each process appends its records to a temporary file that
+is combined into a report in the end:
+
+    from sedac_gpw_parser import profiling, run
+    with profiling.profile("report.json"):
+        run.main(processes=4)
+
+The same is achieved with run.main(processes=4, profile="report.json"). A
+report ending in .csv holds one row per country and stage, a .json report
+additionally holds a summary of the slowest stages and countries.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import tempfile
+import functools
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The environment variable holding the path to the file of raw records. It is
+# inherited by worker processes.
+PROFILE_ENV = "SEDAC_GPW_PROFILE"
+
+MEASURES = ("wall_time", "cpu_time", "read_bytes", "write_bytes",
+            "peak_rss", "peak_rss_increase")
+
+
+def _io_bytes():
+    """
+    Get the number of bytes read and written by the current process.
+
+    :returns: The bytes read and written or None if not available.
+    :rtype: tuple of int
+    """
+    try:
+        with open("/proc/self/io", "r") as infile:
+            counters = dict(_l.split(":") for _l in infile)
+    except (OSError, ValueError):
+        return None, None
+
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def _peak_rss():
+    """
+    Get the peak resident memory of the current process in bytes.
+
+    :returns: The peak memory or None if not available.
+    :rtype: int
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    if sys.platform != "darwin":
+        peak *= 1024
+
+    return peak
+
+
+def _usage():
+    """Take a snapshot of the resources used by the current process."""
+    read_bytes, write_bytes = _io_bytes()
+
+    return {"wall_time": time.perf_counter(),
+            "cpu_time": time.process_time(),
+            "read_bytes": read_bytes,
+            "write_bytes": write_bytes,
+            "peak_rss": _peak_rss()}
+
+
+def _difference(end, start):
+    """Subtract two values that may not be available."""
+    if end is None or start is None:
+        return None
+
+    return end - start
+
+
+def _record(records_path, name, country_id, start):
+    """
+    Append the resources used by a stage to the file of raw records.
+
+    Each record is written with a single call to os.write() on a file opened
+    in append mode such that records of concurrent processes do not mix.
+
+    :param records_path: The path to the file of raw records.
+    :type records_path: str
+
+    :param name: The name of the stage.
+    :type name: str
+
+    :param country_id: The numerical id of the country.
+    :type country_id: int
+
+    :param start: The snapshot taken at the start of the stage.
+    :type start: dict
+    """
+    end = _usage()
+    record = {"pid": os.getpid(), "country_id": country_id, "stage": name}
+    for key in ("wall_time", "cpu_time", "read_bytes", "write_bytes"):
+        record[key] = _difference(end[key], start[key])
+    record["peak_rss"] = end["peak_rss"]
+    record["peak_rss_increase"] = _difference(end["peak_rss"],
+                                              start["peak_rss"])
+
+    line = (json.dumps(record) + "\n").encode()
+    descriptor = os.open(records_path,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+@contextlib.contextmanager
+def stage(name, country_id=None):
+    """
+    Measure the resources used within the context if profiling is enabled.
+
+    :param name: The name of the stage.
+    :type name: str
+
+    :param country_id: The numerical id of the country.
+    :type country_id: int
+    """
+    records_path = os.environ.get(PROFILE_ENV)
+    if not records_path:
+        yield
+        return
+
+    start = _usage()
+    try:
+        yield
+    finally:
+        _record(records_path, name, country_id, start)
+
+
+def profiled(name):
+    """
+    Decorate a method of Grid or its subclasses to be measured as a stage.
+
+    The country is taken from the attribute _country_id of the instance after
+    the method returns.
+
+    :param name: The name of the stage.
+    :type name: str
+    """
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            records_path = os.environ.get(PROFILE_ENV)
+            if not records_path:
+                return method(self, *args, **kwargs)
+
+            start = _usage()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _record(records_path, name, getattr(self, "_country_id", None),
+                        start)
+
+        return wrapper
+
+    return decorator
+
+
+def load_records(records_path):
+    """
+    Load the raw records written while profiling.
+
+    :param records_path: The path to the file of raw records.
+    :type records_path: str
+
+    :rtype: list of dict
+    """
+    if not os.path.exists(records_path):
+        return []
+
+    with open(records_path, "r") as infile:
+        return [json.loads(_l) for _l in infile if _l.strip()]
+
+
+def _aggregate(records, key):
+    """
+    Sum up all measures of the records for each value of a key.
+
+    The peak memory is the maximum instead of the sum.
+
+    :rtype: list of dict sorted by decreasing wall time
+    """
+    groups = {}
+    for record in records:
+        group = groups.setdefault(record[key], {key: record[key], "count": 0})
+        group["count"] += 1
+
+        for measure in MEASURES:
+            value = record[measure]
+            if value is None:
+                continue
+            if measure == "peak_rss":
+                group[measure] = max(group.get(measure, 0), value)
+            else:
+                group[measure] = group.get(measure, 0) + value
+
+    return sorted(groups.values(), key=lambda _g: -_g.get("wall_time", 0))
+
+
+def summarize(records, top=10):
+    """
+    Summarize the raw records by stage and by country.
+
+    :param records: The raw records, see load_records().
+    :type records: list of dict
+
+    :param top: The number of slowest countries in the summary.
+    :type top: int
+
+    :returns: The totals of each stage and of the slowest countries, both
+              sorted by decreasing wall time.
+    :rtype: dict
+    """
+    return {"stages": _aggregate(records, "stage"),
+            "slowest_countries": _aggregate(records, "country_id")[:top]}
+
+
+def print_summary(summary):
+    """Print the summary as returned by summarize()."""
+    print("Stages by total wall time:")
+    for group in summary["stages"]:
+        print("  {0}: {1:.2f} s wall, {2:.2f} s CPU, {3} calls".format(
+            group["stage"], group.get("wall_time", 0),
+            group.get("cpu_time", 0), group["count"]))
+
+    print("Slowest countries:")
+    for group in summary["slowest_countries"]:
+        print("  {0}: {1:.2f} s wall, {2:.2f} s CPU".format(
+            group["country_id"], group.get("wall_time", 0),
+            group.get("cpu_time", 0)))
+
+
+def write_report(records, report_path, top=10):
+    """
+    Write the profiling report to a json or csv file.
+
+    :param records: The raw records, see load_records().
+    :type records: list of dict
+
+    :param report_path: The path to the report. If it ends with .csv, one row
+                        is written for each record. Otherwise, the summary and
+                        all records are written in the json format.
+    :type report_path: str
+
+    :param top: The number of slowest countries in the summary.
+    :type top: int
+
+    :returns: The summary, see summarize().
+    :rtype: dict
+    """
+    summary = summarize(records, top=top)
+
+    if report_path.endswith(".csv"):
+        columns = ("country_id", "stage", "pid") + MEASURES
+        with open(report_path, "w", newline="") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(report_path, "w") as outfile:
+            json.dump(dict(summary, records=records), outfile, indent=2)
+
+    return summary
+
+
+@contextlib.contextmanager
+def profile(report_path, top=10):
+    """
+    Profile all stages that run within the context, including those in worker
+    processes that are started within the context.
+
+    The report is written and summarized when the context is left, also if an
+    error occurred.
+
+    :param report_path: The path to the report, see write_report().
+    :type report_path: str
+
+    :param top: The number of slowest countries in the summary.
+    :type top: int
+    """
+    handle, records_path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(handle)
+
+    previous = os.environ.get(PROFILE_ENV)
+    os.environ[PROFILE_ENV] = records_path
+
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[PROFILE_ENV]
+        else:
+            os.environ[PROFILE_ENV] = previous
+
+        summary = write_report(load_records(records_path), report_path,
+                               top=top)
+        os.remove(records_path)
+        print_summary(summary)
+        print("Profiling report written to", report_path)
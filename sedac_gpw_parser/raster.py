@@ -0,0 +1,155 @@
+"""
+Global raster of country ids for fast point-to-country lookups.
+
+The eight input files of the national identifier grid are combined once into a
+single array with one unsigned 16-bit country id per pixel (21600 rows from 90
+to -90 degrees latitude and 43200 columns from -180 to 180 degrees longitude).
+Pixels that do not belong to any country are set to 0. The array is stored in
+numpy's binary format (about 1.9 GB) and memory-mapped when it is used, so only
+the pages that are actually accessed are read from disk.
+
+Example:
+
+    from sedac_gpw_parser import raster
+    countries = raster.CountryRaster()
+    countries.country_at([2.35, 13.40], [48.86, 52.52])
+    # array([250, 276], dtype=uint16)
+"""
+import os
+import numpy as np
+from sedac_gpw_parser.grid import GRID_FILENAME, _read_ascii_header
+from sedac_gpw_parser.utils import open_input
+
+RASTER_FILE_NAME = "country_ids.npy"
+DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
+
+
+def build_country_raster(
+        output_folder=DATA_FOLDER+"output/",
+        input_folder=DATA_FOLDER+"gpw-v4-national-identifier-grid-rev11_30_sec_asc/"):
+    """
+    Combine the identifier grid into one raster of country ids on disk.
+
+    The raster is written row by row to a memory-mapped file such that the
+    entire array is never held in memory. The file is built under a temporary
+    name and only renamed once it is complete. Hence, an interrupted build
+    never leaves a raster behind that looks complete.
+
+    :param output_folder: The relative path to the desired output folder.
+    :type output_folder: str
+
+    :param input_folder: The relative path to the input data containing the
+                         eight grid files.
+    :type input_folder: str
+
+    :returns: The path to the created file.
+    :rtype: str
+    """
+    grid_path = input_folder + GRID_FILENAME
+    output_path = output_folder + RASTER_FILE_NAME
+    temp_path = output_path + ".tmp"
+
+    if not os.path.exists(output_folder):
+        os.mkdir(output_folder)
+
+    with open_input(grid_path.format(1)) as infile:
+        header = _read_ascii_header(infile)
+    n_row = int(header["nrows"])
+    n_col = int(header["ncols"])
+
+    country_ids = np.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=np.uint16, shape=(2 * n_row, 4 * n_col))
+
+    for file_id in range(1, 9):
+        x_offset = n_col * ((file_id-1) % 4)
+        y_offset = n_row * (file_id > 4)
+
+        with open_input(grid_path.format(file_id)) as infile:
+            header = _read_ascii_header(infile)
+            nodata = int(header["NODATA_value"])
+
+            for row_id in range(n_row):
+                print(file_id, row_id, end="\r")
+                line = np.array(infile.readline().split(), dtype=np.int32)
+                assert len(line) == n_col
+                line[line == nodata] = 0
+                country_ids[row_id + y_offset,
+                            x_offset:(x_offset + n_col)] = line
+
+    country_ids.flush()
+    del country_ids
+    os.replace(temp_path, output_path)
+    print()
+
+    return output_path
+
+
+class CountryRaster():
+    """
+    Look up the country at arbitrary coordinates using the raster created by
+    build_country_raster().
+    """
+
+
+    def __init__(self, output_folder=DATA_FOLDER+"output/",
+                 input_folder=DATA_FOLDER+"gpw-v4-national-identifier-grid-rev11_30_sec_asc/"):
+        """
+        Initialize an instance of CountryRaster.
+
+        The raster is built first if it does not exist yet.
+
+        :param output_folder: The relative path to the folder holding the
+                              raster.
+        :type output_folder: str
+
+        :param input_folder: The relative path to the input data containing
+                             the eight grid files.
+        :type input_folder: str
+        """
+        raster_path = output_folder + RASTER_FILE_NAME
+
+        if not os.path.exists(raster_path):
+            build_country_raster(output_folder=output_folder,
+                                 input_folder=input_folder)
+
+        self._country_ids = np.load(raster_path, mmap_mode="r")
+        self._cellsize = 180 / self._country_ids.shape[0]
+
+
+    def country_at(self, lons, lats):
+        """
+        Get the id of the country that contains each point.
+
+        Longitudes are wrapped around the globe, i.e., both -180 to 180 and 0
+        to 360 degrees can be used. Points at 90 degrees south are assigned
+        to the southernmost row of pixels. Points with NaN coordinates or a
+        latitude beyond the poles are not located in any country.
+
+        :param lons: The longitudes of the points in degrees.
+        :type lons: float or array-like
+
+        :param lats: The latitudes of the points in degrees (-90 to 90).
+        :type lats: float or array-like
+
+        :returns: The country id of each point or 0 if the point is not
+                  located in any country.
+        :rtype: numpy array of uint16
+        """
+        n_row, n_col = self._country_ids.shape
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+
+        # Look up invalid points at (0, 0) and discard the result below
+        valid = (np.isfinite(lons) & np.isfinite(lats) & (lats >= -90)
+                 & (lats <= 90))
+        lons = np.where(valid, lons, 0)
+        lats = np.where(valid, lats, 0)
+
+        cols = np.floor(((lons + 180) % 360) / self._cellsize).astype(np.int64)
+        rows = np.floor((90 - lats) / self._cellsize).astype(np.int64)
+        # Guard against rounding in the modulo and the row of -90 degrees
+        cols = np.minimum(cols, n_col - 1)
+        rows = np.minimum(rows, n_row - 1)
+
+        return np.where(valid, self._country_ids[rows, cols],
+                        0).astype(np.uint16)
@@ -0,0 +1,467 @@
+"""
+Regression harness for the extraction of grid and population data.
+
+Generates small synthetic input files in the format of the SEDAC GPW data set,
+runs every extraction path on them and compares the results with the golden
+outputs that are checked in with the package (folder golden/). Hence, changes
+to the parsers or to the custom file formats of the output files (see grid.py
+and population.py) can be checked to produce identical results.
+
+The synthetic data set consists of 8 tiles with 6x6 pixels each that together
+cover the globe with a cellsize of 15 degrees. It contains the following
+countries:
+
+- 10: Spans four tiles and contains a pixel without population data.
+- 20: Crosses the -180/180 degree meridian and has a row in which only the
+  first column of the first tile belongs to the country.
+- 30: A single pixel.
+- 40: Several ranges of columns per row, a pixel without population data and
+  a pixel with zero population.
+- 50: Touches the lower right corner of the globe.
+
+Pixels outside of all countries have no population data.
+
+The following extraction paths are checked:
+
+- extract: Parse and store the grid and the population of each country.
+- extract_scaled: Same as extract, but the population is stored as integers.
+- extract_zip: Same as extract, but the input files are streamed from .zip
+  archives.
+- load: Load the stored population and export it as a csv table.
+- iter: Iterate over the stored population block by block.
+- lazy: Compute the lazy dask array of the stored population (skipped if dask
+  is not installed).
+- raster: Build the global raster of country ids and look up points with
+  wrapped longitudes and invalid latitudes.
+
+The time needed for each path is printed in the end. Usage:
+
+    python -m sedac_gpw_parser.regression
+    python -m sedac_gpw_parser.regression --update
+    python -m sedac_gpw_parser.regression --upscale 100 --profile report.json
+
+Use --update to regenerate the golden outputs after an intended change of the
+output. Use --upscale K to replace each synthetic pixel by KxK pixels for
+timing on larger input files. The golden outputs are not compared then.
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from sedac_gpw_parser.grid import GRID_FILENAME, COUNTRY_COORDS_FILENAME
+from sedac_gpw_parser.population import (
+    Population, POPULATION_FILE_NAME, POP_OUTPUT_FILE_NAME)
+from sedac_gpw_parser.raster import build_country_raster, CountryRaster
+from sedac_gpw_parser.profiling import profile
+from sedac_gpw_parser import lazy
+
+GOLDEN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "golden")
+
+TILE_SIZE = 6
+CELLSIZE = 15.0
+GRID_NODATA = -32768
+POPULATION_NODATA = "-3.40282346639e+038"
+COUNTRY_IDS = (10, 20, 30, 40, 50)
+SCALE = 1000
+
+GRID_FOLDER = "gpw-v4-national-identifier-grid-rev11_30_sec_asc"
+POPULATION_FOLDER = "gpw-v4-population-count-rev11_2020_30_sec_asc"
+
+
+def synthetic_countries():
+    """
+    Create the global grid of country ids of the synthetic data set.
+
+    :returns: The country id of each pixel or GRID_NODATA. Rows are ordered
+              from north to south.
+    :rtype: 2d numpy array
+    """
+    countries = np.full((2 * TILE_SIZE, 4 * TILE_SIZE), GRID_NODATA)
+
+    countries[3:9, 4:9] = 10
+    countries[3, 4] = GRID_NODATA
+    countries[5, 6] = GRID_NODATA
+
+    countries[1:4, 0:2] = 20
+    countries[1:4, 22:24] = 20
+    countries[4, 0] = 20
+
+    countries[9, 14] = 30
+
+    countries[2, [13, 15, 17]] = 40
+    countries[3, 12:18] = 40
+
+    countries[10:12, 18:24] = 50
+
+    return countries
+
+
+def synthetic_population(countries):
+    """
+    Create the global grid of population counts of the synthetic data set.
+
+    :param countries: The grid of country ids, see synthetic_countries().
+    :type countries: 2d numpy array
+
+    :returns: The population of each pixel with nan for missing data.
+    :rtype: 2d numpy array
+    """
+    random = np.random.RandomState(0)
+    population = np.round(random.uniform(0, 1000, countries.shape), 6)
+
+    population[countries == GRID_NODATA] = np.nan
+    population[5, 7] = np.nan
+    population[3, 14] = np.nan
+    population[2, 13] = 0
+
+    return population
+
+
+def _write_tile(path, values, cellsize, xllcorner, yllcorner, nodata):
+    """
+    Write a tile in the ASCII format of the SEDAC GPW data set.
+
+    :param values: The values of the tile as strings.
+    :type values: 2d numpy array of str
+    """
+    n_row, n_col = values.shape
+
+    with open(path, "w") as outfile:
+        outfile.write("ncols         {0}\n".format(n_col))
+        outfile.write("nrows         {0}\n".format(n_row))
+        outfile.write("xllcorner     {0:g}\n".format(xllcorner))
+        outfile.write("yllcorner     {0:g}\n".format(yllcorner))
+        outfile.write("cellsize      {0!r}\n".format(cellsize))
+        outfile.write("NODATA_value  {0}\n".format(nodata))
+        for row in values:
+            outfile.write(" ".join(row) + " \n")
+
+
+def write_input_files(folder, upscale=1):
+    """
+    Write the synthetic grid and population input files.
+
+    :param folder: The folder in which the input folders are created.
+    :type folder: str
+
+    :param upscale: Each synthetic pixel is replaced by upscale x upscale
+                    pixels.
+    :type upscale: int
+
+    :returns: The paths to the folders of the grid and the population files.
+    :rtype: tuple of str
+    """
+    countries = synthetic_countries()
+    population = synthetic_population(countries)
+
+    block = np.ones((upscale, upscale))
+    countries = np.kron(countries, block).astype(int)
+    population = np.kron(population, block)
+
+    country_strings = countries.astype(str)
+    population_strings = np.array(
+        [[POPULATION_NODATA if np.isnan(_v) else "{0:.6f}".format(_v)
+          for _v in _row] for _row in population])
+
+    grid_folder = os.path.join(folder, GRID_FOLDER) + "/"
+    population_folder = os.path.join(folder, POPULATION_FOLDER) + "/"
+    os.makedirs(grid_folder)
+    os.makedirs(population_folder)
+
+    size = TILE_SIZE * upscale
+    cellsize = CELLSIZE / upscale
+
+    for file_id in range(1, 9):
+        col = size * ((file_id-1) % 4)
+        row = size * (file_id > 4)
+        tile = (slice(row, row + size), slice(col, col + size))
+        xllcorner = -180 + col * cellsize
+        yllcorner = 90 - (row + size) * cellsize
+
+        _write_tile(grid_folder + GRID_FILENAME.format(file_id),
+                    country_strings[tile], cellsize, xllcorner, yllcorner,
+                    GRID_NODATA)
+        _write_tile(population_folder + POPULATION_FILE_NAME.format(file_id),
+                    population_strings[tile], cellsize, xllcorner, yllcorner,
+                    POPULATION_NODATA)
+
+    return grid_folder, population_folder
+
+
+def _zip_folder(folder):
+    """
+    Replace a folder by a .zip archive of the same name.
+
+    :param folder: The path to the folder ending with a slash.
+    :type folder: str
+    """
+    folder = folder.rstrip("/")
+    name = os.path.basename(folder)
+
+    with zipfile.ZipFile(folder + ".zip", "w") as archive:
+        for file_name in sorted(os.listdir(folder)):
+            archive.write(os.path.join(folder, file_name),
+                          arcname=name + "/" + file_name)
+
+    shutil.rmtree(folder)
+
+
+def _extract(input_folder, output_folder, scale=None):
+    """Parse and store grid and population of all synthetic countries."""
+    grid_folder = os.path.join(input_folder, GRID_FOLDER) + "/"
+    population_folder = os.path.join(input_folder, POPULATION_FOLDER) + "/"
+
+    for country_id in COUNTRY_IDS:
+        Population(country_id, output_folder=output_folder,
+                   population_input_folder=population_folder,
+                   grid_input_folder=grid_folder, load=False, scale=scale)
+
+
+def _load(output_folder):
+    """Load the stored population of all synthetic countries."""
+    return {_c: Population(_c, output_folder=output_folder)
+            for _c in COUNTRY_IDS}
+
+
+def _compare_files(path, golden_path):
+    """
+    Compare an output file with its golden version.
+
+    :returns: A description of the first difference or None if the files are
+              identical.
+    :rtype: str
+    """
+    if not os.path.exists(golden_path):
+        return "{0} is missing.".format(golden_path)
+
+    with open(path, "r") as infile:
+        lines = infile.readlines()
+    with open(golden_path, "r") as infile:
+        golden_lines = infile.readlines()
+
+    for i, (line, golden_line) in enumerate(zip(lines, golden_lines)):
+        if line != golden_line:
+            return "{0}, line {1}: {2!r} != {3!r}".format(
+                os.path.basename(golden_path), i + 1, line, golden_line)
+
+    if len(lines) != len(golden_lines):
+        return "{0}: {1} lines != {2} lines".format(
+            os.path.basename(golden_path), len(lines), len(golden_lines))
+
+    return None
+
+
+def _check_outputs(outputs, golden_folder, update):
+    """
+    Compare all output files with their golden versions or update these.
+
+    :param outputs: The path to each output file and the name of its golden
+                    version.
+    :type outputs: list of (str, str)
+
+    :returns: The description of each difference.
+    :rtype: list of str
+    """
+    if update:
+        for path, golden_name in outputs:
+            shutil.copyfile(path, os.path.join(golden_folder, golden_name))
+        return []
+
+    differences = [_compare_files(path, os.path.join(golden_folder, _g))
+                   for path, _g in outputs]
+
+    return [_d for _d in differences if _d is not None]
+
+
+def _stored_outputs(output_folder, suffix=""):
+    """Get the output files of extract() and the names of their golden files."""
+    outputs = [(output_folder + "file_index.txt", "file_index.txt")]
+
+    for country_id in COUNTRY_IDS:
+        outputs.append((output_folder + COUNTRY_COORDS_FILENAME.format(
+            country_id), COUNTRY_COORDS_FILENAME.format(country_id)))
+        name = POP_OUTPUT_FILE_NAME.format(country_id)
+        root, extension = os.path.splitext(name)
+        outputs.append((output_folder + name, root + suffix + extension))
+
+    return outputs
+
+
+def run(update=False, upscale=1, golden_folder=GOLDEN_FOLDER):
+    """
+    Run all extraction paths on the synthetic data set.
+
+    :param update: If True, the golden outputs are overwritten with the
+                   current outputs.
+    :type update: bool
+
+    :param upscale: Each synthetic pixel is replaced by upscale x upscale
+                    pixels. If larger than 1, the golden outputs are neither
+                    compared nor updated.
+    :type upscale: int
+
+    :param golden_folder: The folder holding the golden outputs.
+    :type golden_folder: str
+
+    :returns: The description of each failed check and the time needed for
+              each extraction path in seconds.
+    :rtype: tuple of (list of str, dict)
+    """
+    compare = upscale == 1
+    failures = []
+    timings = {}
+
+    if update and not compare:
+        raise ValueError("The golden outputs can only be updated for "
+                         "upscale=1.")
+    if update and not os.path.exists(golden_folder):
+        os.makedirs(golden_folder)
+
+    def check(name, outputs):
+        if compare:
+            failures.extend("{0}: {1}".format(name, _d) for _d in
+                            _check_outputs(outputs, golden_folder, update))
+
+    def timed(name, function, *args, **kwargs):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args, **kwargs)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    with tempfile.TemporaryDirectory() as folder:
+        input_folder = os.path.join(folder, "input")
+        zip_folder = os.path.join(folder, "zip")
+        write_input_files(input_folder, upscale=upscale)
+        grid_folder, population_folder = write_input_files(
+            zip_folder, upscale=upscale)
+        _zip_folder(grid_folder)
+        _zip_folder(population_folder)
+
+        output_folder = os.path.join(folder, "extract") + "/"
+        timed("extract", _extract, input_folder, output_folder)
+        check("extract", _stored_outputs(output_folder))
+
+        scaled_folder = os.path.join(folder, "extract_scaled") + "/"
+        timed("extract_scaled", _extract, input_folder, scaled_folder,
+              scale=SCALE)
+        check("extract_scaled", _stored_outputs(scaled_folder, "_scaled"))
+
+        zipped_folder = os.path.join(folder, "extract_zip") + "/"
+        timed("extract_zip", _extract, zip_folder, zipped_folder)
+        check("extract_zip", _stored_outputs(zipped_folder))
+
+        populations = timed("load", _load, output_folder)
+        outputs = []
+        for country_id, pop in populations.items():
+            path = os.path.join(folder, "{0}.csv".format(country_id))
+            pop.export(path, file_format="csv")
+            outputs.append((path, os.path.basename(path)))
+        check("load", outputs)
+
+        scaled = timed("load_scaled", _load, scaled_folder)
+        for country_id, pop in populations.items():
+            expected = pop.population_array()
+            if not np.allclose(scaled[country_id].population_array(),
+                               expected, rtol=0, atol=0.5 / SCALE):
+                failures.append("load_scaled: {0} differs by more than the "
+                                "quantization error".format(country_id))
+
+        start = time.perf_counter()
+        for country_id, pop in populations.items():
+            blocks = [_b for _, _b in pop.iter_population(block_rows=2)]
+            if not np.array_equal(np.concatenate(blocks),
+                                  pop.population_array()):
+                failures.append("iter: {0} differs from load".format(
+                    country_id))
+        timings["iter"] = time.perf_counter() - start
+
+        if lazy.dask is not None:
+            start = time.perf_counter()
+            for country_id, pop in populations.items():
+                array = lazy.as_dask_array(pop, chunk_rows=2).compute()
+                if not np.array_equal(array, pop.population_array()):
+                    failures.append("lazy: {0} differs from load".format(
+                        country_id))
+            timings["lazy"] = time.perf_counter() - start
+
+        raster_folder = os.path.join(folder, "raster") + "/"
+        raster_path = timed("raster", build_country_raster,
+                            output_folder=raster_folder,
+                            input_folder=os.path.join(input_folder,
+                                                      GRID_FOLDER) + "/")
+        text_path = os.path.join(folder, "country_ids.txt")
+        np.savetxt(text_path, np.load(raster_path), fmt="%d")
+        check("raster", [(text_path, "country_ids.txt")])
+
+        # Longitude, latitude and expected country id of each point
+        points = np.array([(-170, 70, 20), (190, 70, 20), (-10, 70, 0),
+                           (240, 10, 10), (170, -90, 50), (100, -91, 0),
+                           (np.nan, 70, 0)])
+        found = CountryRaster(
+            output_folder=raster_folder,
+            input_folder=None).country_at(points[:, 0], points[:, 1])
+        for (lon, lat, expected), country_id in zip(points, found):
+            if country_id != expected:
+                failures.append("raster: found {0} instead of {1:g} at "
+                                "({2:g}, {3:g})".format(country_id, expected,
+                                                        lon, lat))
+
+    return failures, timings
+
+
+def main(argv=None):
+    """
+    Run the regression harness from the command line.
+
+    :param argv: The command-line arguments. If None, sys.argv is used.
+    :type argv: list of str
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m sedac_gpw_parser.regression",
+        description="Compare the extraction of synthetic input files with "
+                    "golden outputs.")
+    parser.add_argument("--update", action="store_true",
+                        help="Overwrite the golden outputs")
+    parser.add_argument("--upscale", type=int, default=1,
+                        help="Replace each pixel by UPSCALE x UPSCALE pixels "
+                             "and only record the timings")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Write the time, I/O and memory used by each "
+                             "stage and country to a .json or .csv file")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        context = profile(args.profile)
+    else:
+        context = contextlib.nullcontext()
+
+    with context:
+        failures, timings = run(update=args.update, upscale=args.upscale)
+
+    for name, seconds in timings.items():
+        print("{0}: {1:.3f} s".format(name, seconds))
+
+    if args.update:
+        print("Golden outputs updated in", GOLDEN_FOLDER)
+    elif args.upscale > 1:
+        print("Golden outputs not compared for upscale > 1.")
+
+    for failure in failures:
+        print("FAILED", failure)
+
+    if failures:
+        sys.exit(1)
+
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Conservative regridding of population counts to a user-supplied target grid.
+
+The population of each source pixel is distributed over all cells of the target
+grid in proportion to the area of the pixel that falls into each cell. Since
+both grids are regular latitude/longitude grids the fractional overlaps
+factorize into a latitudinal and a longitudinal part. For a population array P
+(rows from north to south) the regridded array is hence given by
+
+    Wy @ P @ Wx.T
+
+where Wy and Wx are sparse matrices that hold the fraction of each source row
+(column) that falls into each target row (column). The latitudinal fractions
+account for the shrinking of cells towards the poles, i.e., they are measured
+in terms of the sine of the latitude. Both matrices are computed once for each
+pair of source window and target grid and are cached for later use.
+
+Longitudes are compared modulo 360 degrees. Hence, the target grid may use any
+longitude convention, e.g., -180 to 180 or 0 to 360 degrees, and source pixels
+that wrap around the edge of the target grid are split accordingly. Population
+in pixels that lie outside of the target grid is not counted.
+"""
+import functools
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
+
+
+TargetGrid = namedtuple(
+    "TargetGrid", ["llcrnrlon", "llcrnrlat", "dlon", "dlat", "nlon", "nlat"])
+TargetGrid.__doc__ = """
+A regular latitude/longitude grid to which population data can be regridded.
+
+The grid is described by its lower left corner (llcrnrlon, llcrnrlat), the
+width and height of each cell (dlon, dlat) and the number of cells in
+longitudinal and latitudinal direction (nlon, nlat). All values are measured
+in degrees. For example, a global grid with 0.25 degree resolution reads:
+
+    TargetGrid(llcrnrlon=-180, llcrnrlat=-90, dlon=0.25, dlat=0.25,
+               nlon=1440, nlat=720)
+
+The same grid with longitudes from 0 to 360 degrees reads:
+
+    TargetGrid(llcrnrlon=0, llcrnrlat=-90, dlon=0.25, dlat=0.25,
+               nlon=1440, nlat=720)
+"""
+
+
+def _overlap_matrix(src_edges, tgt_edges, measure=None):
+    """
+    Compute the fraction of each source interval that falls into each target
+    interval.
+
+    :param src_edges: The n+1 ascending edges of n source intervals.
+    :type src_edges: 1d numpy array
+
+    :param tgt_edges: The m+1 ascending edges of m target intervals.
+    :type tgt_edges: 1d numpy array
+
+    :param measure: A monotonic function applied to all edges before the
+                    length of an interval is computed. If None, the length of
+                    an interval is the difference of its edges.
+    :type measure: callable
+
+    :returns: Sparse matrix of shape (m, n).
+    :rtype: scipy.sparse.csr_matrix
+
+    Examples:
+    >>> _overlap_matrix(np.arange(5.), np.array([0., 1.5, 4.])).toarray()
+    array([[1. , 0.5, 0. , 0. ],
+           [0. , 0.5, 1. , 1. ]])
+    """
+    if measure is None:
+        measure = lambda x: x
+
+    src_lo, src_hi = src_edges[:-1], src_edges[1:]
+    tgt_lo, tgt_hi = tgt_edges[:-1], tgt_edges[1:]
+
+    # Range of target intervals that overlap with each source interval
+    first = np.searchsorted(tgt_hi, src_lo, side="right")
+    last = np.searchsorted(tgt_lo, src_hi, side="left")
+    counts = np.maximum(last - first, 0)
+
+    src_ids = np.repeat(np.arange(len(src_lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    tgt_ids = np.repeat(first, counts) + offsets
+
+    lower = np.maximum(src_lo[src_ids], tgt_lo[tgt_ids])
+    upper = np.minimum(src_hi[src_ids], tgt_hi[tgt_ids])
+    fraction = (measure(upper) - measure(lower)) / \
+        (measure(src_hi[src_ids]) - measure(src_lo[src_ids]))
+
+    valid = fraction > 0
+
+    return sparse.csr_matrix(
+        (fraction[valid], (tgt_ids[valid], src_ids[valid])),
+        shape=(len(tgt_lo), len(src_lo)))
+
+
+def _longitude_overlap_matrix(src_edges, tgt_edges):
+    """
+    Compute the fraction of each source interval that falls into each target
+    interval, where longitudes are compared modulo 360 degrees.
+
+    The source edges are shifted by a multiple of 360 degrees such that the
+    western edge lies less than 360 degrees west of the western edge of the
+    target grid. The overlaps with the target grid are then the sum of the
+    overlaps of the shifted source and of the source shifted by another 360
+    degrees.
+
+    :param src_edges: The n+1 ascending edges of n source intervals spanning
+                      at most 360 degrees.
+    :type src_edges: 1d numpy array
+
+    :param tgt_edges: The m+1 ascending edges of m target intervals spanning
+                      at most 360 degrees.
+    :type tgt_edges: 1d numpy array
+
+    :returns: Sparse matrix of shape (m, n).
+    :rtype: scipy.sparse.csr_matrix
+
+    Examples:
+    The pixel from -45 to 45 degrees is split across both ends of a grid from
+    0 to 360 degrees:
+
+    >>> _longitude_overlap_matrix(np.array([-45., 45.]),
+    ...                           np.array([0., 180., 360.])).toarray()
+    array([[0.5],
+           [0.5]])
+    """
+    shift = 360 * np.floor((tgt_edges[0] - src_edges[0]) / 360)
+    weights = _overlap_matrix(src_edges + shift, tgt_edges)
+    weights += _overlap_matrix(src_edges + shift + 360, tgt_edges)
+
+    return weights.tocsr()
+
+
+@functools.lru_cache(maxsize=32)
+def regrid_weights(north, west, cellsize, n_row, n_col, target_grid):
+    """
+    Compute the latitudinal and longitudinal weight matrices for regridding.
+
+    The results are cached such that repeated calls for the same source window
+    and target grid, e.g., for several epochs of the same country, cost
+    nothing.
+
+    :param north: The latitude of the upper edge of the source window.
+    :type north: float
+
+    :param west: The longitude of the left edge of the source window.
+    :type west: float
+
+    :param cellsize: The size of each source pixel in degrees.
+    :type cellsize: float
+
+    :param n_row: The number of rows of the source window.
+    :type n_row: int
+
+    :param n_col: The number of columns of the source window.
+    :type n_col: int
+
+    :param target_grid: The grid to which the data is regridded.
+    :type target_grid: TargetGrid
+
+    :returns: The weights Wy of shape (target_grid.nlat, n_row) and Wx of
+              shape (target_grid.nlon, n_col). Rows of Wy are ordered from
+              north to south.
+    :rtype: tuple of scipy.sparse.csr_matrix
+    """
+    if target_grid.nlon * target_grid.dlon > 360 + 1e-9:
+        raise ValueError("The target grid spans more than 360 degrees of "
+                         "longitude.")
+
+    lon_edges = west + np.arange(n_col + 1) * cellsize
+    tgt_lon_edges = target_grid.llcrnrlon + \
+        np.arange(target_grid.nlon + 1) * target_grid.dlon
+    weights_x = _longitude_overlap_matrix(lon_edges, tgt_lon_edges)
+
+    # Edges in ascending order, i.e., from south to north
+    lat_edges = north - np.arange(n_row + 1)[::-1] * cellsize
+    tgt_lat_edges = target_grid.llcrnrlat + \
+        np.arange(target_grid.nlat + 1) * target_grid.dlat
+    weights_y = _overlap_matrix(
+        lat_edges, tgt_lat_edges, measure=lambda x: np.sin(np.radians(x)))
+
+    # Flip both axes such that rows and columns run from north to south
+    weights_y = weights_y[::-1][:, ::-1].tocsr()
+
+    return weights_y, weights_x
+
+
+def regrid(blocks, north, west, cellsize, n_row, n_col, target_grid):
+    """
+    Conservatively regrid population counts to a target grid.
+
+    Pixels with negative values (no data or not in country) do not contribute.
+
+    :param blocks: Consecutive blocks of rows of the population array and the
+                   index of the first row of each block, e.g., as returned by
+                   Population.iter_population().
+    :type blocks: iterable of (int, 2d numpy array)
+
+    :param north: See regrid_weights().
+    :param west: See regrid_weights().
+    :param cellsize: See regrid_weights().
+    :param n_row: See regrid_weights().
+    :param n_col: See regrid_weights().
+    :param target_grid: See regrid_weights().
+
+    :returns: The population count in each cell of the target grid. Rows are
+              ordered from north to south.
+    :rtype: 2d numpy array
+
+    Examples:
+    A global window regridded to a grid with longitudes from 0 to 360 degrees
+    keeps the total population:
+
+    >>> blocks = [(0, np.arange(24.).reshape(2, 12))]
+    >>> grid = TargetGrid(llcrnrlon=0, llcrnrlat=-90, dlon=45, dlat=30,
+    ...                   nlon=8, nlat=6)
+    >>> regridded = regrid(blocks, north=45, west=-180, cellsize=30,
+    ...                    n_row=2, n_col=12, target_grid=grid)
+    >>> bool(np.isclose(regridded.sum(), np.arange(24.).sum()))
+    True
+    """
+    weights_y, weights_x = regrid_weights(
+        north, west, cellsize, n_row, n_col, target_grid)
+
+    regridded = np.zeros((target_grid.nlat, target_grid.nlon))
+
+    for row_offset, block in blocks:
+        block = np.where(block > 0, block, 0)
+        rows = weights_y[:, row_offset:(row_offset+len(block))]
+        regridded += rows @ (weights_x @ block.T).T
+
+    return regridded
@@ -13,41 +13,121 @@ for each valid country:
     pipeline.
 """
 import os
-from sedac_gpw_parser.plot import Plot
+import time
+import tempfile
+import contextlib
+from sedac_gpw_parser.plot import Plot, render_countries, SKIPPED_COUNTRIES
+from sedac_gpw_parser.utils import open_input
+from sedac_gpw_parser.profiling import profile as profile_stages
 
 COUNTRY_CODES = "gpw-v4-national-identifier-grid-rev11_30_sec_asc/"\
         "gpw_v4_national_identifier_grid_rev11_lookup.txt"
 DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
 
-def main():
+
+def _load_countries():
     """
-    Load the list of valid country codes and create output for each country.
+    Load the ids and names of all countries from the lookup table.
 
-    Two output files and one plot are created for each country.
+    :returns: The numeric id and the name of each country.
+    :rtype: list of (int, str)
     """
-    with open(DATA_FOLDER+COUNTRY_CODES, "r") as infile:
+    with open_input(DATA_FOLDER+COUNTRY_CODES) as infile:
         infile.readline()
         info = [(int(_l.split("\t")[0]), _l.split("\t")[3]) for _l in infile]
 
-    for c_id, name in info:
+    return info
+
+
+def benchmark(countries, processes=1, fast=False):
+    """
+    Compare the plotting throughput of Plot.plot() and render_countries().
+
+    All variants use the same plotting mode and write their plots to
+    temporary folders. render_countries() is measured with a single process
+    first, such that only the reuse of the figure is compared to Plot.plot(),
+    and additionally with the given number of processes. The data for each
+    country should already be parsed and stored on disk such that only loading
+    and plotting is measured.
+
+    :param countries: The numeric ids and titles of the countries to plot.
+    :type countries: list of (int, str)
+
+    :param processes: The number of worker processes for render_countries().
+    :type processes: int
+
+    :param fast: Whether to use the fast plotting mode (see Plot.plot()) in
+                 all variants.
+    :type fast: bool
+
+    :returns: The throughput of each variant measured in maps per minute.
+    :rtype: dict
+    """
+    throughput = {}
+
+    with tempfile.TemporaryDirectory() as plot_folder:
+        start = time.perf_counter()
+        for c_id, name in countries:
+            plot = Plot(c_id, plot_folder=plot_folder)
+            plot.plot(title=name, fast=fast)
+        elapsed = time.perf_counter() - start
+        throughput["plot"] = 60 * len(countries) / elapsed
+
+    variants = [(1, "render_countries")]
+    if processes > 1:
+        variants.append((processes, "render_countries ({0} processes)".format(
+            processes)))
+
+    for n_processes, method in variants:
+        with tempfile.TemporaryDirectory() as plot_folder:
+            start = time.perf_counter()
+            render_countries(countries, plot_folder=plot_folder,
+                             processes=n_processes, fast=fast)
+            elapsed = time.perf_counter() - start
+            throughput[method] = 60 * len(countries) / elapsed
 
-        if c_id in [554, 643, 840]:
-            # 554, 643, 840 the three countries that span the -180/180 degree
-            # latitude line and hence cause an array of population data that is
-            # too large to be plotted on a map.
-            # These countries are:
-            # - New Zealand (554)
-            # - Russia (643)
-            # - USA (840)
+    for method, maps_per_minute in throughput.items():
+        print(method, ": {0:.2f} maps per minute".format(maps_per_minute))
+
+    return throughput
+
+
+def main(processes=1, profile=None):
+    """
+    Load the list of valid country codes and create output for each country.
+
+    Two output files and one plot are created for each country.
+
+    :param processes: The number of worker processes used for plotting.
+    :type processes: int
+
+    :param profile: If given, the path to a .json or .csv file to which the
+                    wall time, CPU time, I/O and peak memory of each stage and
+                    country are written (see profiling.py).
+    :type profile: str
+    """
+    countries = []
+
+    for c_id, name in _load_countries():
+
+        if c_id in SKIPPED_COUNTRIES:
+            # See plot.SKIPPED_COUNTRIES
             print(c_id, "caused errors in the past. Skipping for now...")
             continue
 
         if os.path.exists("plots/{0}.png".format(c_id)):
             print(c_id, "already present.")
         else:
-            print("Running for country:", c_id)
-            plot = Plot(c_id)
-            plot.plot(title=name)
+            countries.append((c_id, name))
+
+    if profile is None:
+        context = contextlib.nullcontext()
+    else:
+        context = profile_stages(profile)
+
+    with context:
+        render_countries(countries, plot_folder="./plots/",
+                         processes=processes, fast=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,278 @@
+"""
+Compute population-weighted statistics for many countries at once.
+
+The stored population data of each country is read only once, block by block
+(see Population.iter_population()). While iterating, all requested statistics
+are accumulated at the same time:
+
+- total_population: The total population of the country.
+- centroid: The population-weighted centroid (centroid_lon, centroid_lat). The
+  centroid is computed from the mean of the unit vectors of all pixels and is
+  hence also valid for countries that span the -180/180 degree meridian.
+- density_quantiles: Population-weighted quantiles of the population per
+  pixel (density_q10, density_q50, ...), i.e., the population per pixel that
+  10%, 50%, ... of the population live below.
+- urban_share: The share of the population that lives in pixels with at least
+  a given population (urban_share_300, urban_share_1500, ...).
+- gini: The Gini coefficient of the population across all valid pixels.
+- lorenz: Points of the Lorenz curve, i.e., the share of the population that
+  lives in the least populated 10%, 20%, ... of all valid pixels (lorenz_p10,
+  lorenz_p20, ...).
+
+Quantiles, the Gini coefficient and the Lorenz curve are computed from a fine
+logarithmic histogram of the population per pixel and are hence approximations
+with a relative resolution of about 2% in the population per pixel.
+
+The results are returned as a tidy table where each row holds the country id,
+the name of the statistic and its value:
+
+    [(250, 'total_population', 65194287.0),
+     (250, 'centroid_lon', 2.61),
+     ...]
+"""
+import csv
+import multiprocessing
+import numpy as np
+from sedac_gpw_parser.population import Population
+from sedac_gpw_parser.utils import open_output
+
+STATISTICS = ("total_population", "centroid", "density_quantiles",
+              "urban_share", "gini", "lorenz")
+
+# Bin edges of the histogram of the population per pixel. The first bin holds
+# all pixels with (almost) no population.
+HISTOGRAM_EDGES = np.concatenate(([0], np.logspace(-3, 7, 1001)))
+
+
+def _weighted_centroid(sums):
+    """
+    Convert the sum of weighted unit vectors into longitude and latitude.
+
+    Examples:
+    >>> _weighted_centroid(np.array([0., 1., 1.]))
+    (90.0, 45.0)
+    """
+    sum_x, sum_y, sum_z = sums
+    lon = np.degrees(np.arctan2(sum_y, sum_x))
+    lat = np.degrees(np.arctan2(sum_z, np.hypot(sum_x, sum_y)))
+
+    return float(lon), float(lat)
+
+
+def _lorenz_curve(counts, populations):
+    """
+    Compute the Lorenz curve from a histogram of the population per pixel.
+
+    :param counts: The number of pixels in each bin.
+    :type counts: 1d numpy array
+
+    :param populations: The total population in each bin.
+    :type populations: 1d numpy array
+
+    :returns: The cumulative share of pixels and population at the upper edge
+              of each bin, starting at (0, 0).
+    :rtype: tuple of 1d numpy arrays
+
+    Examples:
+    >>> _lorenz_curve(np.array([1, 1]), np.array([0., 10.]))
+    (array([0. , 0.5, 1. ]), array([0., 0., 1.]))
+    """
+    pixel_share = np.concatenate(([0], np.cumsum(counts) / counts.sum()))
+    pop_share = np.concatenate(
+        ([0], np.cumsum(populations) / populations.sum()))
+
+    return pixel_share, pop_share
+
+
+def _gini(counts, populations):
+    """
+    Compute the Gini coefficient from a histogram of the population per pixel.
+
+    Examples:
+    >>> _gini(np.array([1, 1]), np.array([0., 10.]))
+    0.5
+    """
+    pixel_share, pop_share = _lorenz_curve(counts, populations)
+    area = np.sum(np.diff(pixel_share) * (pop_share[1:] + pop_share[:-1]))
+
+    return float(1 - area)
+
+
+def _weighted_quantile(edges, populations, quantile):
+    """
+    Compute a population-weighted quantile of the population per pixel by
+    linear interpolation within the bins of a histogram.
+
+    Examples:
+    >>> _weighted_quantile(np.array([0., 10., 20.]), np.array([5., 5.]), 0.5)
+    10.0
+    """
+    cumulative = np.concatenate(([0], np.cumsum(populations)))
+    cumulative /= cumulative[-1]
+
+    return float(np.interp(quantile, cumulative, edges))
+
+
+def country_statistics(country_id, statistics=STATISTICS,
+                       quantiles=(0.1, 0.5, 0.9), urban_thresholds=(300, 1500),
+                       lorenz_points=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8,
+                                      0.9),
+                       block_rows=1024, **population_kwargs):
+    """
+    Compute population-weighted statistics for a single country.
+
+    See the module docstring for a description of all statistics.
+
+    :param country_id: The numerical id of the country.
+    :type country_id: int
+
+    :param statistics: The names of the statistics to compute.
+    :type statistics: list of str
+
+    :param quantiles: The quantiles for density_quantiles.
+    :type quantiles: list of float
+
+    :param urban_thresholds: The minimum population per pixel of urban pixels
+                             for urban_share.
+    :type urban_thresholds: list of float
+
+    :param lorenz_points: The shares of all pixels at which the Lorenz curve
+                          is evaluated.
+    :type lorenz_points: list of float
+
+    :param block_rows: The number of rows that are processed at once.
+    :type block_rows: int
+
+    :param population_kwargs: Further keyword arguments passed to Population,
+                              e.g., output_folder.
+
+    :returns: Tidy table with rows (country_id, statistic, value).
+    :rtype: list of (int, str, float)
+    """
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError("Unknown statistic: " + str(statistic))
+
+    pop = Population(country_id, load=False, **population_kwargs)
+    pop.load_header()
+
+    cellsize = pop._cellsize
+    # latitude_range() holds the upper edge of each row
+    lats = np.radians(np.flip(pop.latitude_range()) - cellsize / 2)
+    lons = np.radians(pop.longitude_range() + cellsize / 2)
+    cos_lon = np.cos(lons)
+    sin_lon = np.sin(lons)
+
+    vector_sums = np.zeros(3)
+    hist_counts = np.zeros(len(HISTOGRAM_EDGES) - 1)
+    hist_populations = np.zeros(len(HISTOGRAM_EDGES) - 1)
+    urban_populations = np.zeros(len(urban_thresholds))
+
+    for row_offset, block in pop.iter_population(block_rows=block_rows):
+        weights = np.where(block > 0, block, 0)
+        block_lats = lats[row_offset:(row_offset+len(block))]
+
+        if "centroid" in statistics:
+            row_x = weights @ cos_lon
+            row_y = weights @ sin_lon
+            row_sums = weights.sum(axis=1)
+            vector_sums += (np.cos(block_lats) @ row_x,
+                            np.cos(block_lats) @ row_y,
+                            np.sin(block_lats) @ row_sums)
+
+        valid = block[block >= 0]
+        counts, _ = np.histogram(valid, bins=HISTOGRAM_EDGES)
+        populations, _ = np.histogram(valid, bins=HISTOGRAM_EDGES,
+                                      weights=valid)
+        hist_counts += counts
+        hist_populations += populations
+
+        for i, threshold in enumerate(urban_thresholds):
+            urban_populations[i] += valid[valid >= threshold].sum()
+
+    total_population = pop.total_population()
+    table = []
+
+    if "total_population" in statistics:
+        table.append((country_id, "total_population", float(total_population)))
+
+    if "centroid" in statistics:
+        lon, lat = _weighted_centroid(vector_sums)
+        table.append((country_id, "centroid_lon", lon))
+        table.append((country_id, "centroid_lat", lat))
+
+    if "density_quantiles" in statistics:
+        for quantile in quantiles:
+            value = _weighted_quantile(HISTOGRAM_EDGES, hist_populations,
+                                       quantile)
+            name = "density_q{0:g}".format(100 * quantile)
+            table.append((country_id, name, value))
+
+    if "urban_share" in statistics:
+        for threshold, urban in zip(urban_thresholds, urban_populations):
+            name = "urban_share_{0:g}".format(threshold)
+            table.append((country_id, name, float(urban / total_population)))
+
+    if "gini" in statistics:
+        table.append((country_id, "gini", _gini(hist_counts,
+                                                hist_populations)))
+
+    if "lorenz" in statistics:
+        pixel_share, pop_share = _lorenz_curve(hist_counts, hist_populations)
+        for point in lorenz_points:
+            name = "lorenz_p{0:g}".format(100 * point)
+            value = float(np.interp(point, pixel_share, pop_share))
+            table.append((country_id, name, value))
+
+    return table
+
+
+def _country_statistics(args):
+    """Unpack the arguments for country_statistics() in a worker process."""
+    country_id, kwargs = args
+    return country_statistics(country_id, **kwargs)
+
+
+def batch_statistics(country_ids, processes=1, **kwargs):
+    """
+    Compute population-weighted statistics for many countries.
+
+    The data of each country must already be parsed and stored on disk (see
+    Population).
+
+    :param country_ids: The numerical ids of the countries.
+    :type country_ids: list of int
+
+    :param processes: The number of worker processes.
+    :type processes: int
+
+    :param kwargs: Further keyword arguments passed to country_statistics().
+
+    :returns: Tidy table with rows (country_id, statistic, value).
+    :rtype: list of (int, str, float)
+    """
+    tasks = [(country_id, kwargs) for country_id in country_ids]
+
+    if processes == 1:
+        results = [_country_statistics(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_country_statistics, tasks, chunksize=1)
+
+    return [row for result in results for row in result]
+
+
+def save_table(table, output_path):
+    """
+    Write a table as returned by batch_statistics() to a csv file.
+
+    :param table: Tidy table with rows (country_id, statistic, value).
+    :type table: list of (int, str, float)
+
+    :param output_path: The path to the output file.
+    :type output_path: str
+    """
+    with open_output(output_path, newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(("country_id", "statistic", "value"))
+        writer.writerows(table)
@@ -1,34 +1,313 @@
+"""
+Helpers to look up countries in the SEDAC GPW data set.
+
+The lookup table provided with the national identifier grid is loaded only once
+into a CountryRegistry that holds normalized search keys for all country names.
+All following lookups, including reverse lookups from ids to names and batch
+lookups of many search terms at once, are answered from memory.
+
+Also provides open_input() to read the input files either from the extracted
+folders or straight from the downloaded .zip archives, and open_output() to
+write output files such that they only appear once they are complete.
+"""
+import io
 import os
+import zipfile
+import contextlib
+import functools
+import numpy as np
 
 GRID_FOLDER = "gpw-v4-national-identifier-grid-rev11_30_sec_asc/"
 GRID_LOOKUP = "gpw_v4_national_identifier_grid_rev11_lookup.txt"
+FILE_INDEX = "output/file_index.txt"
 DATA_FOLDER = os.path.expanduser("~") + "/.sedac_gpw_parser/"
 
+
+def open_input(path):
+    """
+    Open an input file of the SEDAC GPW data set for reading.
+
+    If the file does not exist, it is streamed from the .zip archive that
+    belongs to the folder of the file. For example, if
+
+    ~/.sedac_gpw_parser/gpw-v4-population-count-rev11_2020_30_sec_asc/gpw_v4_population_count_rev11_2020_30_sec_1.asc
+
+    is missing, the file is read from the corresponding member of
+
+    ~/.sedac_gpw_parser/gpw-v4-population-count-rev11_2020_30_sec_asc.zip
+
+    without extracting it to disk. Hence, the archives downloaded by
+    download-sedac-gpw-data.sh need not be extracted.
+
+    :param path: The path to the input file.
+    :type path: str
+
+    :returns: The opened file or archive member in text mode.
+    :rtype: io.TextIOWrapper
+    """
+    if os.path.exists(path):
+        return open(path, "r")
+
+    folder, file_name = os.path.split(path)
+    archive_path = folder + ".zip"
+
+    if not os.path.exists(archive_path):
+        raise FileNotFoundError(
+            "Neither {0} nor {1} exists.".format(path, archive_path))
+
+    # The opened member keeps the archive open until the member is closed
+    with zipfile.ZipFile(archive_path) as archive:
+        members = [_m for _m in archive.namelist()
+                   if os.path.basename(_m) == file_name]
+        if not members:
+            raise FileNotFoundError(
+                "{0} is not contained in {1}.".format(file_name, archive_path))
+        stream = archive.open(members[0])
+
+    return io.TextIOWrapper(stream)
+
+
+@contextlib.contextmanager
+def open_output(path, mode="w", **kwargs):
+    """
+    Open an output file for writing such that it only appears once it is
+    completely written.
+
+    The data is written to a temporary file in the same folder that replaces
+    the output file when the context is left without an error. Hence, an
+    interrupted job never leaves a truncated output file behind that would be
+    taken as complete when the job is started again.
+
+    Example:
+
+        with open_output("output/250_population.txt") as outfile:
+            outfile.write(data)
+
+    :param path: The path to the output file.
+    :type path: str
+
+    :param mode: The mode in which the file is opened, e.g., 'w' or 'wb'.
+    :type mode: str
+
+    :param kwargs: Further keyword arguments passed to open().
+
+    :returns: The opened temporary file.
+    :rtype: file object
+    """
+    temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+
+    try:
+        with open(temp_path, mode, **kwargs) as outfile:
+            yield outfile
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _normalize(name):
+    """
+    Normalize a country name or search term for comparison.
+
+    Examples:
+    >>> _normalize("United Kingdom")
+    'unitedkingdom'
+    """
+    return name.lower().replace(" ", "")
+
+
+class CountryRegistry():
+    """
+    In-memory index of all countries in the lookup table of the grid data.
+    """
+
+
+    def __init__(self, lookup_file=DATA_FOLDER+GRID_FOLDER+GRID_LOOKUP,
+                 file_index=DATA_FOLDER+FILE_INDEX):
+        """
+        Initialize an instance of CountryRegistry.
+
+        :param lookup_file: The path to the tab-separated lookup table that
+                            ships with the national identifier grid.
+        :type lookup_file: str
+
+        :param file_index: The path to the file index created by Grid (see
+                           Grid.save_file_index()). If the file does not
+                           exist, no information on the input files that
+                           contain each country is available.
+        :type file_index: str
+        """
+        ids = []
+        names = []
+
+        with open_input(lookup_file) as infile:
+            infile.readline()
+
+            for line in infile:
+                line = line.rstrip("\n").split("\t")
+                ids.append(int(line[0]))
+                names.append(line[3])
+
+        file_ids = {}
+
+        if os.path.exists(file_index):
+            with open(file_index, "r") as infile:
+                infile.readline()
+                for line in infile:
+                    country, file_list = line.split(" ")
+                    file_list = file_list[:-1].split(",")
+                    file_ids[int(country)] = [int(_f) for _f in file_list]
+
+        self._ids = np.array(ids)
+        self._names = names
+        self._keys = np.array([_normalize(_n) for _n in names])
+        self._positions = {country_id: i for i, country_id in enumerate(ids)}
+        self._file_ids = file_ids
+
+
+    def lookup(self, searchterm, mode="substring"):
+        """
+        Find all countries whose name matches a search term.
+
+        Spaces and capitalization are ignored in both, the search term and the
+        country names.
+
+        :param searchterm: The (partial) name of a country.
+        :type searchterm: str
+
+        :param mode: One of 'exact', 'prefix' or 'substring'. Determines
+                     whether the search term must match the entire name, the
+                     beginning of the name or any part of the name.
+        :type mode: str
+
+        :returns: The name and id of each matching country.
+        :rtype: list of (str, int)
+        """
+        searchterm = _normalize(searchterm)
+        keys = self._keys
+
+        if mode == "exact":
+            matches = keys == searchterm
+        elif mode == "prefix":
+            matches = np.char.startswith(keys, searchterm)
+        elif mode == "substring":
+            matches = np.char.find(keys, searchterm) >= 0
+        else:
+            raise ValueError("Unknown lookup mode: " + str(mode))
+
+        return [(self._names[i], int(self._ids[i]))
+                for i in np.flatnonzero(matches)]
+
+
+    def batch_lookup(self, searchterms, mode="substring"):
+        """
+        Look up many search terms at once.
+
+        :param searchterms: The (partial) names of countries.
+        :type searchterms: list of str
+
+        :param mode: See CountryRegistry.lookup().
+        :type mode: str
+
+        :returns: The matching countries for each search term.
+        :rtype: dict of list of (str, int)
+        """
+        return {term: self.lookup(term, mode=mode) for term in searchterms}
+
+
+    def name(self, country_id):
+        """
+        Get the name of a country from its id.
+
+        :param country_id: The numerical id of a country.
+        :type country_id: int
+
+        :returns: The name of the country.
+        :rtype: str
+        """
+        return self._names[self._positions[country_id]]
+
+
+    def names(self, country_ids):
+        """
+        Get the names of several countries from their ids.
+
+        :param country_ids: The numerical ids of the countries.
+        :type country_ids: list of int
+
+        :returns: The names of the countries in the same order.
+        :rtype: list of str
+        """
+        return [self.name(country_id) for country_id in country_ids]
+
+
+    def info(self, country_id):
+        """
+        Get all available metadata for a country.
+
+        :param country_id: The numerical id of a country.
+        :type country_id: int
+
+        :returns: The id, name and the ids of the input files (tiles) that
+                  contain the country. The list of file ids is None if no file
+                  index was available when the registry was loaded.
+        :rtype: dict
+        """
+        return {"id": country_id,
+                "name": self.name(country_id),
+                "file_ids": self._file_ids.get(country_id)}
+
+
+    def country_ids(self):
+        """
+        Get the ids of all countries in the lookup table.
+
+        :rtype: list of int
+        """
+        return [int(_i) for _i in self._ids]
+
+
+@functools.lru_cache(maxsize=None)
+def load_registry(lookup_file=DATA_FOLDER+GRID_FOLDER+GRID_LOOKUP,
+                  file_index=DATA_FOLDER+FILE_INDEX):
+    """
+    Load the CountryRegistry for the given lookup table only once.
+
+    Later calls with the same arguments return the same instance. Use
+    load_registry.cache_clear() to reload the registry, e.g., after the file
+    index was generated.
+
+    :rtype: CountryRegistry
+    """
+    return CountryRegistry(lookup_file=lookup_file, file_index=file_index)
+
+
 def id_lookup(searchterm, lookup_file=DATA_FOLDER+GRID_FOLDER+GRID_LOOKUP,
-              verbose=True):
-
-    success = False
-
-    names_ids = []
-    
-    searchterm = searchterm.lower().replace(" ", "")
-
-    with open(lookup_file, "r") as infile:
-        infile.readline()
-
-        for line in infile:
-            line = line.split("\t")
-            country_id = line[0]
-            country_name = line[3]
-            
-            if searchterm.lower() in country_name.lower().replace(" ", ""):
-                if verbose:
-                    print(country_name, ":", country_id)
-                success = True
-                names_ids.append((country_name, int(country_id)))
-
-    if not success:
-        if verbose:
-            print("No country found for search term:", searchterm)
+              verbose=True, mode="substring"):
+    """
+    Find the ids of all countries whose name matches a search term.
+
+    :param searchterm: The (partial) name of a country.
+    :type searchterm: str
+
+    :param lookup_file: The path to the lookup table of the grid data.
+    :type lookup_file: str
+
+    :param verbose: Whether to print the matching countries.
+    :type verbose: bool
+
+    :param mode: See CountryRegistry.lookup().
+    :type mode: str
+
+    :returns: The name and id of each matching country.
+    :rtype: list of (str, int)
+    """
+    names_ids = load_registry(lookup_file).lookup(searchterm, mode=mode)
+
+    if verbose:
+        for country_name, country_id in names_ids:
+            print(country_name, ":", country_id)
+        if not names_ids:
+            print("No country found for search term:", _normalize(searchterm))
 
     return names_ids
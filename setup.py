@@ -13,17 +13,21 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/marcwie/sedac-gpw-parser",
     packages=setuptools.find_packages(include=("sedac_gpw_parser",)),
+    package_data={"sedac_gpw_parser": ["golden/*"]},
     #classifiers=[
     #    "Programming Language :: Python :: 3",
     #    "License :: OSI Approved :: MIT License",
     #    "Operating System :: OS Independent",
     #],
     scripts=("bash_scripts/download-sedac-gpw-data.sh", ),
+    entry_points={
+        "console_scripts": ["sedac-gpw-parser=sedac_gpw_parser.cli:main"]},
     python_requires='>=3',
     setup_requires=['numpy', 'cython'], # This is needed for proper install of cartopy
     install_requires=['numpy', 
                       'matplotlib', 
                       'cartopy', 
                       'scipy',      # Scipy is required for cartopy to work
-                      'shapely<=1.6.4.post2']  
+                      'shapely<=1.6.4.post2'],
+    extras_require={"dask": ["dask[array]", "xarray"]}
     )